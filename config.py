@@ -11,6 +11,13 @@ TMP_DIR = "img_tmp"
 IMAGE_PATH = "img"
 THUMBNAIL_PATH = "img_thumb"
 MEDIUM_IMAGE_PATH = "img_medium"
+IMAGE_MANIFEST = "img_manifest.json"
+IMAGE_CACHE_PATH = "img_cache"
+
+# Image widths that can be requested from /img/<size>/<filename>
+IMAGE_SIZES = [320, 512, 768, 1110]
+# Disk space for images resized on demand (bytes, shared by all worker processes)
+IMAGE_CACHE_BYTES = 500 * 1024 * 1024
 RECIPE_JSON = "recipe-list.json"
 
 ADMIN_PASSWORD = "password"
@@ -30,6 +37,14 @@ DB_USER = ""
 DB_PASSWORD = ""
 DB_HOST = "127.0.0.1"
 DB_PORT = 3306
+DB_MAX_CONNECTIONS = 20  # Maximum number of pooled connections per worker
+DB_STALE_TIMEOUT = 300   # Recycle pooled connections older than this (seconds)
+DB_POOL_TIMEOUT = 10     # Time to wait for a free connection when the pool is exhausted (seconds)
+
+# Answer /search?q= from the in-process search index (recapi/searchindex.py)
+SEARCH_INDEX = True
+# Use the FULLTEXT index for /search when SEARCH_INDEX is off (see manage_db_offline.add_fulltext_index)
+SEARCH_FULLTEXT = True
 
 # List of randomizer tags (for /random route)
 RANDOM_TAGS = ["lunch/middag"]
@@ -1,6 +1,8 @@
 """Offline management of database."""
 
+import json
 import os
+import timeit
 
 import peewee as pw
 import playhouse.migrate
@@ -133,6 +135,147 @@ def change_max_length():
     )
 
 
+def migrate_taglist():
+    """Add the denormalised tag list column to the recipe table and fill it."""
+    init_db()
+    migrator = playhouse.migrate.MySQLMigrator(config.SQLDB)
+    playhouse.migrate.migrate(
+        migrator.add_column("recipe", "taglist", pw.TextField(default="[]"))
+    )
+    backfill_taglist()
+
+
+def backfill_taglist():
+    """Rebuild the tag list column of all recipes from the RecipeTags table."""
+    init_db()
+    from recapi.models import changemodel, recipemodel, tagmodel
+    with config.SQLDB.atomic():
+        for recipe in recipemodel.Recipe.select(recipemodel.Recipe.id):
+            tagmodel.update_taglist(recipe.id)
+    changemodel.log_change(kind=changemodel.ALL)
+
+
+def check_taglist():
+    """Find recipes whose tag list column does not match the RecipeTags table."""
+    init_db()
+    from recapi.models import recipemodel, tagmodel
+    broken = []
+    for recipe in recipemodel.Recipe.select(recipemodel.Recipe.id, recipemodel.Recipe.title, recipemodel.Recipe.taglist):
+        expected = recipemodel.make_taglist(tagmodel.get_taglist(recipe.id))
+        if recipe.taglist != expected:
+            broken.append(recipe.id)
+            print(f"{recipe.id} {recipe.title}: {recipe.taglist} (expected {expected})")
+    print(f"{len(broken)} recipes with inconsistent tag list.")
+    return broken
+
+
+def migrate_html():
+    """Add the columns for rendered HTML to the recipe table and fill them."""
+    init_db()
+    migrator = playhouse.migrate.MySQLMigrator(config.SQLDB)
+    playhouse.migrate.migrate(
+        migrator.add_column("recipe", "ingredients_html", pw.TextField(default="")),
+        migrator.add_column("recipe", "contents_html", pw.TextField(default=""))
+    )
+    render_html()
+
+
+def render_html():
+    """Re-render the HTML of all recipes, e.g. after changing the markdown extensions or the bleach whitelist."""
+    init_db()
+    from recapi.models import changemodel, recipemodel
+    from recapi import utils
+    Recipe = recipemodel.Recipe
+    recipes = list(Recipe.select(Recipe.id, Recipe.ingredients, Recipe.contents).dicts())
+    ingredients = utils.md_renderer.render_many([r["ingredients"] for r in recipes])
+    contents = utils.md_renderer.render_many([r["contents"] for r in recipes])
+    with config.SQLDB.atomic():
+        for recipe, ingredients_html, contents_html in zip(recipes, ingredients, contents):
+            Recipe.update(
+                ingredients_html=ingredients_html, contents_html=contents_html
+            ).where(Recipe.id == recipe["id"]).execute()
+    changemodel.log_change(kind=changemodel.ALL)
+
+
+def add_fulltext_index():
+    """Add the FULLTEXT index used by /search to the recipe table."""
+    init_db()
+    from recapi.models import recipemodel
+    columns = ", ".join(c.column_name for c in recipemodel.FULLTEXT_COLUMNS)
+    config.SQLDB.execute_sql(f"ALTER TABLE recipe ADD FULLTEXT INDEX recipe_fulltext ({columns})")
+
+
+def benchmark_serialiser(rounds=20):
+    """Check that the recipe serialiser gives the same output as model_to_dict and compare their speed."""
+    init_db()
+    from playhouse.shortcuts import model_to_dict
+    from recapi.models import recipemodel, storedmodel, usermodel
+    Recipe, Stored, User = recipemodel.Recipe, storedmodel.Stored, usermodel.User
+    Changed = User.alias()
+
+    def joined(query):
+        return query.join(
+            Stored, pw.JOIN.LEFT_OUTER, on=(Stored.recipeID == Recipe.id)
+        ).switch(Recipe).join(
+            User, pw.JOIN.LEFT_OUTER, on=(User.id == Recipe.created_by).alias("a")
+        ).switch(Recipe).join(
+            Changed, pw.JOIN.LEFT_OUTER, on=(Changed.id == Recipe.changed_by).alias("b")
+        ).order_by(Recipe.id)
+
+    model_rows = list(joined(Recipe.select(Recipe, User, Changed, Stored)))
+    dict_rows = list(joined(Recipe.select(
+        *recipemodel.select_columns(complete_data=True), Stored.stored.alias("stored"),
+        *recipemodel.user_columns(User, "created_by"), *recipemodel.user_columns(Changed, "changed_by"))).dicts())
+
+    def with_model_to_dict(complete_data):
+        data = []
+        for recipe in model_rows:
+            r = model_to_dict(recipe, recurse=False,
+                              exclude=[Recipe.taglist, Recipe.ingredients_html, Recipe.contents_html])
+            r["tags"] = json.loads(recipe.taglist)
+            r["stored"] = recipe.stored.stored
+            if complete_data:
+                r["created_by"] = model_to_dict(recipe.a)
+                r["created_by"].pop("password")
+                r["changed_by"] = model_to_dict(recipe.b if hasattr(recipe, "b") else User())
+                r["changed_by"].pop("password")
+            else:
+                r = {k: v for k, v in r.items() if k in recipemodel.LISTING_FIELDS}
+            data.append(r)
+        return data
+
+    for complete_data in (False, True):
+        reference = with_model_to_dict(complete_data)
+        result = recipemodel.get_recipes(dict_rows, complete_data=complete_data)
+        assert result == reference, "Serialiser output differs from model_to_dict!"
+        old = timeit.timeit(lambda: with_model_to_dict(complete_data), number=rounds) / rounds
+        new = timeit.timeit(lambda: recipemodel.get_recipes(dict_rows, complete_data=complete_data),
+                            number=rounds) / rounds
+        print("complete_data=%s, %s recipes: model_to_dict %.2f ms, serialiser %.2f ms (%.1fx)" % (
+            complete_data, len(dict_rows), old * 1000, new * 1000, old / new if new else 0))
+
+
+def benchmark_markdown(rounds=5):
+    """Check that the reusable markdown renderer gives the same html as before and compare their speed."""
+    init_db()
+    import bleach
+    import markdown
+    from bleach_whitelist import markdown_attrs, markdown_tags
+    from recapi import utils
+    from recapi.models import recipemodel
+    Recipe = recipemodel.Recipe
+    texts = [t for r in Recipe.select(Recipe.ingredients, Recipe.contents).tuples() for t in r]
+
+    def old_md2html():
+        return [bleach.clean(markdown.markdown(t), markdown_tags, markdown_attrs) for t in texts]
+
+    assert utils.md_renderer.render_many(texts) == old_md2html(), "Renderer output differs!"
+    old = timeit.timeit(old_md2html, number=rounds) / rounds
+    new = timeit.timeit(lambda: utils.md_renderer.render_many(texts), number=rounds) / rounds
+    print("%s texts: markdown+bleach.clean %.3f ms/text, renderer %.3f ms/text (%.1fx)" % (
+        len(texts), old * 1000 / len(texts), new * 1000 / len(texts), old / new if new else 0))
+
+
 if __name__ == '__main__':
     # migrate_example()
     # update_recipes()
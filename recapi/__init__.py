@@ -2,7 +2,6 @@
 
 import logging
 import os
-import shutil
 import sys
 import time
 
@@ -10,8 +9,8 @@ from flask import Flask
 from flask_cors import CORS
 from flask_session import Session
 
-from recapi import utils
-from recapi.models import recipemodel, storedmodel, tagmodel, usermodel
+from recapi import images
+from recapi.models import changemodel, recipemodel, storedmodel, tagmodel, usermodel
 
 
 def create_app():
@@ -65,17 +64,6 @@ def create_app():
         logging.basicConfig(filename=logfile, level=logging.INFO,
                             format=logfmt, datefmt=datefmt)
 
-    # Create thumbnails and medium sized images
-    defaultimg = os.path.join(app.static_folder, "default.jpg")
-    srcfolder = os.path.join(app.instance_path, app.config.get("IMAGE_PATH"))
-    thumbnailfolder = os.path.join(app.instance_path, app.config.get("THUMBNAIL_PATH"))
-    mediumfolder = os.path.join(app.instance_path, app.config.get("MEDIUM_IMAGE_PATH"))
-    shutil.copy(defaultimg, srcfolder)
-    for imgfile in os.listdir(srcfolder):
-        src = os.path.join(srcfolder, imgfile)
-        utils.save_downscaled(src, thumbnailfolder, thumbnail=True, overwrite=False)
-        utils.save_downscaled(src, mediumfolder, overwrite=False)
-
     # Init session
     Session(app)
 
@@ -86,7 +74,10 @@ def create_app():
         user=app.config.get("DB_USER"),
         password=app.config.get("DB_PASSWORD"),
         host=app.config.get("DB_HOST"),
-        port=app.config.get("DB_PORT"))
+        port=app.config.get("DB_PORT"),
+        max_connections=app.config.get("DB_MAX_CONNECTIONS"),
+        stale_timeout=app.config.get("DB_STALE_TIMEOUT"),
+        timeout=app.config.get("DB_POOL_TIMEOUT"))
     app.config["SQLDB"] = DATABASE
 
     # Create tables
@@ -97,18 +88,14 @@ def create_app():
     tagmodel.Tag.create_table()
     tagmodel.RecipeTags.create_table()
     storedmodel.Stored.create_table()
+    changemodel.Change.create_table()
     app.config.get("SQLDB").close()
 
-    @app.before_request
-    def before_request():
-        """Connect to database before request."""
-        app.config.get("SQLDB").connect()
-
-    @app.after_request
-    def after_request(response):
-        """Close connection to database after request."""
-        app.config.get("SQLDB").close()
-        return response
+    @app.teardown_request
+    def teardown_request(exception):
+        """Return database connection to the pool if the request used one."""
+        if not app.config.get("SQLDB").is_closed():
+            app.config.get("SQLDB").close()
 
     # Register blueprints
     from .views import authentication, documentation, general, parse_html, recipe_data
@@ -118,6 +105,9 @@ def create_app():
     app.register_blueprint(parse_html.bp)
     app.register_blueprint(documentation.bp)
 
+    # Register CLI commands
+    app.cli.add_command(images.build_images_command)
+
     return app
 
 
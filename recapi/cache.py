@@ -0,0 +1,150 @@
+"""In-process caches that are kept coherent across workers with the change log."""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g
+
+from recapi.models import changemodel
+
+
+# Change log entries are read again this many versions back, in case an entry has been committed
+# after an entry with a higher ID (IDs are assigned on insert, not on commit)
+LOOKBACK = 50
+
+
+class LRUCache(object):
+    """Thread-safe dictionary that drops the least recently used entries when it gets too big.
+
+    If ttl is set, entries also expire after ttl seconds. Hits and misses are counted for stats.
+    Values can be stored with the catalogue version they were read at. They are not stored if the
+    cache has been invalidated for a newer version in the meantime.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = OrderedDict()  # key -> (expiry time or None, value)
+        self.version = 0  # catalogue version of the latest invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Get value for key and mark it as recently used."""
+        with self.lock:
+            expires, value = self.data.get(key, (None, default))
+            if key not in self.data or (expires is not None and expires < time.monotonic()):
+                self.data.pop(key, None)
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, version=None):
+        """Store value for key. Skip values read at an older catalogue version than the latest invalidation."""
+        with self.lock:
+            if version is not None and version < self.version:
+                return
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key from the cache and return its value."""
+        with self.lock:
+            return self.data.pop(key, (None, default))[1]
+
+    def clear(self, _changes=None, version=None):
+        """Remove all entries. Can be used as subscriber for the catalogue."""
+        with self.lock:
+            self.data.clear()
+            self.invalidated(version)
+
+    def forget_recipes(self, changes=None, version=None):
+        """Remove the entries of changed recipes. Subscriber for caches keyed by recipe ID."""
+        if changes is None:
+            self.clear(version=version)
+            return
+        with self.lock:
+            for recipe_id, _kind in changes:
+                self.data.pop(recipe_id, None)
+            self.invalidated(version)
+
+    def invalidated(self, version):
+        """Remember the catalogue version of the latest invalidation (call with the lock held)."""
+        if version is not None:
+            self.version = max(self.version, version)
+
+    def stats(self):
+        """Get size, hits, misses and hit rate."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None
+        }
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Catalogue(object):
+    """Keep track of the catalogue version and notify subscribers about changes.
+
+    Every write adds an entry to the change log in the data base once it has been committed. When
+    a worker notices that the version has changed, it reads the new log entries and passes a list
+    of (recipe ID, kind) and the new version to all subscribers. The list is None if everything
+    must be considered changed.
+
+    A log entry that is committed after an entry with a higher ID is picked up with the next
+    change, as long as it is at most LOOKBACK versions behind.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.seen = set()  # IDs of the log entries within LOOKBACK of the version
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Register callback(changes, version) to be called when the catalogue version changes."""
+        self.subscribers.append(callback)
+
+    def sync(self):
+        """Check the catalogue version (once per request) and notify subscribers about changes."""
+        if "catalogue_version" in g:
+            return g.catalogue_version
+        version = changemodel.get_version()
+        with self.lock:
+            if version != self.version:
+                since = version if self.version is None or version < self.version else self.version
+                entries = [e for e in changemodel.get_changes(since - LOOKBACK, version) if e[0] not in self.seen]
+                changes = None
+                if since != version:
+                    changes = [(recipe_id, kind) for _change_id, recipe_id, kind in entries]
+                    if any(kind == changemodel.ALL for _recipe_id, kind in changes):
+                        changes = None
+                for callback in self.subscribers:
+                    callback(changes, version)
+                if changes is None:
+                    self.seen.clear()
+                self.seen = {change_id for change_id in self.seen if change_id > version - LOOKBACK}
+                self.seen.update(change_id for change_id, _recipe_id, _kind in entries)
+                self.version = version
+        g.catalogue_version = version
+        return version
+
+    def changed(self, recipe_id=None, kind=changemodel.RECIPE):
+        """Log a change to the catalogue. Call after the change has been committed."""
+        changemodel.log_change(recipe_id, kind)
+        g.pop("catalogue_version", None)
+
+
+catalogue = Catalogue()
@@ -1,4 +1,8 @@
-"""General parser class (abstract)."""
+"""General parser class (abstract) and registry of all parsers."""
+
+import importlib
+import pkgutil
+import urllib.parse
 
 import requests
 
@@ -6,12 +10,63 @@ from abc import ABC, abstractmethod
 from bs4 import BeautifulSoup
 
 
+class ParserRegistry(object):
+    """Registry of all parser classes.
+
+    Parsers are indexed by their domain labels in reversed order, e.g. ('se', 'ica'),
+    so that any subdomain of a parser's domain resolves with a few dict lookups.
+    """
+
+    def __init__(self):
+        self.parsers = []
+        self.index = {}
+        self.metadata = []
+        self.loaded = False
+
+    def register(self, parser):
+        """Add a parser class to the registry."""
+        self.parsers.append(parser)
+        self.index[tuple(reversed(parser.domain.lower().split(".")))] = parser
+        self.metadata.append({"domain": parser.domain,
+                              "name": parser.name,
+                              "address": parser.address,
+                              "version": parser.version})
+
+    def load(self):
+        """Import all modules from the html_parsers package (only once)."""
+        if self.loaded:
+            return
+        for (_module_loader, name, _ispkg) in pkgutil.iter_modules(__path__):
+            importlib.import_module(f"{__name__}.{name}")
+        self.loaded = True
+
+    def find(self, url):
+        """Find parser that can parse url. Return None if there is none."""
+        hostname = urllib.parse.urlsplit(url).hostname or ""
+        labels = tuple(reversed(hostname.split(".")))
+        # Prefer the longest matching domain
+        for n in range(len(labels), 0, -1):
+            parser = self.index.get(labels[:n])
+            if parser:
+                return parser
+        return None
+
+
+registry = ParserRegistry()
+
+
 class GeneralParser(ABC):
     """Abstract parser class."""
 
     domain = ""
     name = ""
     address = ""
+    version = "1.0"
+
+    def __init_subclass__(cls, **kwargs):
+        """Register every parser class when it is defined."""
+        super().__init_subclass__(**kwargs)
+        registry.register(cls)
 
     def make_soup(self):
         """Get HTML and create BeautifulSoup object."""
@@ -0,0 +1,233 @@
+"""Creation and caching of downscaled image derivatives."""
+
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import time
+import traceback
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from PIL import Image
+
+from recapi import utils
+
+# Folder (inside the derivative cache) for the lock files and number of lock files
+LOCK_FOLDER = ".locks"
+LOCK_STRIPES = 64
+
+# Derivatives used within this many seconds are not evicted
+EVICT_MIN_AGE = 10
+
+
+def get_targets(app):
+    """Get a list of (folder, size) for all derivatives configured for app."""
+    return [
+        (os.path.join(app.instance_path, app.config.get("THUMBNAIL_PATH")), utils.THUMBNAIL_SIZE),
+        (os.path.join(app.instance_path, app.config.get("MEDIUM_IMAGE_PATH")), utils.MEDIUM_IMAGE_SIZE),
+    ]
+
+
+def target_key(folder, size):
+    """Create the manifest key for a derivative folder and size."""
+    return f"{os.path.basename(folder)}:{size[0]}x{size[1]}"
+
+
+def load_manifest(manifest_path):
+    """Load the derivative manifest. Return an empty manifest if there is none."""
+    try:
+        with open(manifest_path, encoding="UTF-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_path, files):
+    """Write the derivative manifest atomically."""
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="UTF-8") as f:
+        json.dump({"files": files}, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def build_derivatives(srcfolder, targets, manifest_path, workers=None):
+    """Create missing derivatives for all images in srcfolder.
+
+    The manifest records mtime, size and the existing derivatives of every source image,
+    so unchanged images are skipped without looking at the derivative folders.
+    Missing conversions are run in a process pool.
+    """
+    manifest = load_manifest(manifest_path)
+    files = {}
+    jobs = []
+    with os.scandir(srcfolder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            stat = entry.stat()
+            record = manifest.get(entry.name, {})
+            done = []
+            if record.get("mtime") == stat.st_mtime and record.get("size") == stat.st_size:
+                done = record.get("derivatives", [])
+            files[entry.name] = {"mtime": stat.st_mtime, "size": stat.st_size, "derivatives": list(done)}
+            for folder, size in targets:
+                if target_key(folder, size) not in done:
+                    jobs.append((entry.name, entry.path, folder, size))
+
+    for folder, _size in targets:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    failed = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(utils.downscale, src, folder, size): (name, folder, size)
+                       for name, src, folder, size in jobs}
+            for future in as_completed(futures):
+                name, folder, size = futures[future]
+                try:
+                    future.result()
+                    files[name]["derivatives"].append(target_key(folder, size))
+                except Exception:
+                    failed.append(name)
+
+    save_manifest(manifest_path, files)
+    return {"images": len(files), "converted": len(jobs) - len(failed), "failed": sorted(set(failed))}
+
+
+def build_app_derivatives(app, workers=None):
+    """Copy the default image into the image folder and create all missing derivatives."""
+    srcfolder = os.path.join(app.instance_path, app.config.get("IMAGE_PATH"))
+    if not os.path.exists(srcfolder):
+        os.makedirs(srcfolder)
+
+    defaultimg = os.path.join(app.static_folder, "default.jpg")
+    defaultdest = os.path.join(srcfolder, "default.jpg")
+    if not os.path.exists(defaultdest) or os.path.getsize(defaultdest) != os.path.getsize(defaultimg):
+        shutil.copy(defaultimg, defaultdest)
+
+    manifest_path = os.path.join(app.instance_path, app.config.get("IMAGE_MANIFEST"))
+    return build_derivatives(srcfolder, get_targets(app), manifest_path, workers=workers)
+
+
+@click.command("build_images")
+@click.option("--workers", default=None, type=int, help="Number of worker processes (default: number of CPUs).")
+@with_appcontext
+def build_images_command(workers):
+    """Create missing thumbnails and medium sized images."""
+    try:
+        result = build_app_derivatives(current_app, workers=workers)
+    except Exception:
+        current_app.logger.error(traceback.format_exc())
+        raise
+    click.echo("Checked %s images, created %s derivatives." % (result["images"], result["converted"]))
+    if result["failed"]:
+        click.echo("Failed to convert: %s" % ", ".join(result["failed"]))
+
+
+class DerivativeCache(object):
+    """LRU disk cache for images downscaled on demand, bounded by a byte budget.
+
+    The cache folder is shared by all worker processes: files are marked as used by setting
+    their access time, and whenever a file has been created the folder is scanned and the least
+    recently used files are removed until it fits into the budget again. Concurrent requests
+    for the same derivative are serialised with file locks, so every derivative is only created
+    once. New files are written to a temporary name and renamed when complete.
+    """
+
+    def __init__(self, lock_stripes=LOCK_STRIPES):
+        self.lock_stripes = lock_stripes
+
+    def get(self, src, folder, width, max_bytes):
+        """Return the path to src downscaled to width. Create the file if it is missing or outdated."""
+        filename = os.path.splitext(os.path.basename(src))[0] + ".jpg"
+        outpath = os.path.join(folder, str(width), filename)
+        src_mtime = os.path.getmtime(src)
+
+        with self.key_lock(folder, outpath):
+            try:
+                mtime = os.path.getmtime(outpath)
+            except OSError:
+                mtime = None
+            created = mtime is None or mtime < src_mtime
+            if created:
+                resize_to_width(src, outpath, width)
+            else:
+                # Mark as recently used (keep the mtime, which is compared with the source image)
+                os.utime(outpath, (time.time(), mtime))
+
+        if created:
+            self.evict(folder, max_bytes, keep=outpath)
+        return outpath
+
+    @contextlib.contextmanager
+    def key_lock(self, folder, key):
+        """Hold an exclusive lock for key that is shared by all threads and processes.
+
+        Keys are hashed onto a fixed number of lock files, so the lock files never need to be removed.
+        """
+        lock_folder = os.path.join(folder, LOCK_FOLDER)
+        os.makedirs(lock_folder, exist_ok=True)
+        stripe = zlib.crc32(key.encode("UTF-8")) % self.lock_stripes
+        with open(os.path.join(lock_folder, f"{stripe}.lock"), "a") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def scan(self, folder):
+        """Get (access time, path, size) for all files in the cache folder."""
+        found = []
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if d != LOCK_FOLDER]
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_atime, path, stat.st_size))
+        return found
+
+    def evict(self, folder, max_bytes, keep=None):
+        """Remove least recently used files until the cache folder fits into max_bytes.
+
+        Files used within the last EVICT_MIN_AGE seconds are kept, so they can still be sent.
+        """
+        found = self.scan(folder)
+        total_bytes = sum(size for _atime, _path, size in found)
+        min_atime = time.time() - EVICT_MIN_AGE
+        for atime, path, size in sorted(found):
+            if total_bytes <= max_bytes or atime > min_atime:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total_bytes -= size
+            except OSError:
+                pass
+
+
+def resize_to_width(src, outpath, width):
+    """Downscale src to width (keeping the aspect ratio) and save it as jpg in outpath."""
+    outfolder = os.path.dirname(outpath)
+    if not os.path.exists(outfolder):
+        os.makedirs(outfolder, exist_ok=True)
+    tmp_path = "%s.%s.tmp" % (outpath, os.getpid())
+    im = Image.open(src)
+    im = im.convert("RGB")
+    im.thumbnail((width, im.height))
+    im.save(tmp_path, "JPEG")
+    os.replace(tmp_path, outpath)
+
+
+derivative_cache = DerivativeCache()
@@ -1,8 +1,10 @@
 """Abstract Meta class to be inherited from by all peewee models."""
 
 import peewee as pw
+from playhouse.pool import PooledMySQLDatabase
 
-DATABASE = pw.MySQLDatabase(None)
+# Connections are checked out of the pool on the first query of a request
+DATABASE = PooledMySQLDatabase(None)
 
 
 class BaseModel(pw.Model):
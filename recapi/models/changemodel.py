@@ -0,0 +1,45 @@
+"""Change log model, used to keep the caches of all workers up to date."""
+
+import datetime
+
+import peewee as pw
+
+from recapi.models import BaseModel
+
+# Kinds of changes
+RECIPE = "recipe"
+TAGS = "tags"  # tags have been created or removed
+ALL = "all"
+
+
+class Change(BaseModel):
+    """Change log table (peewee model). The ID of the latest entry is the catalogue version."""
+
+    recipeID = pw.IntegerField(null=True)
+    kind = pw.CharField(max_length="20", default=RECIPE)
+    created = pw.DateTimeField()
+
+
+def log_change(recipe_id=None, kind=RECIPE):
+    """Add entry to the change log and return the new catalogue version.
+
+    Call after the change has been committed, so other workers do not read the catalogue before it is visible.
+    """
+    change = Change(
+        recipeID=recipe_id,
+        kind=kind,
+        created=datetime.datetime.now()
+    )
+    change.save()
+    return change.id
+
+
+def get_version():
+    """Get the current catalogue version (0 if nothing has been changed yet)."""
+    return Change.select(pw.fn.MAX(Change.id)).scalar() or 0
+
+
+def get_changes(since, until):
+    """Get (change ID, recipe ID, kind) for all changes after version 'since' up to version 'until'."""
+    return list(Change.select(Change.id, Change.recipeID, Change.kind).where(
+        (Change.id > since) & (Change.id <= until)).tuples())
@@ -1,10 +1,13 @@
 """Recipe database model."""
 
+import base64
 import datetime
+import json
 import re
+from functools import reduce
 
 import peewee as pw
-from playhouse.shortcuts import model_to_dict
+from playhouse.mysql_ext import Match
 
 from recapi.models import BaseModel, usermodel
 
@@ -28,6 +31,44 @@ class Recipe(BaseModel):
     suggester = pw.CharField(max_length="100", null=True)
     needs_fix = pw.BooleanField(default=False)
     needs_fix_text = pw.TextField()
+    taglist = pw.TextField(default="[]")  # Sorted tag names as JSON (maintained by tagmodel)
+    ingredients_html = pw.TextField(default="")  # Rendered and sanitised ingredients
+    contents_html = pw.TextField(default="")     # Rendered and sanitised contents
+
+
+# Ways to sort recipe listings
+ORDERS = ["newest", "title"]
+
+# Sort order of ranked search results (their cursor is the offset of the next page)
+RELEVANCE = "relevance"
+
+# Data included in recipe listings
+LISTING_FIELDS = ["id", "title", "url", "image", "published", "needs_fix", "tags", "stored"]
+
+# Data that is not stored in the Recipe table
+EXTRA_FIELDS = ["tags", "stored"]
+
+# Markdown fields and the columns with their rendered HTML
+HTML_FIELDS = {"ingredients": "ingredients_html", "contents": "contents_html"}
+
+# Recipe data stored in the Recipe table (taglist and the HTML columns are only used internally)
+RECIPE_FIELDS = [f for f in Recipe._meta.sorted_field_names if f != "taglist" and f not in HTML_FIELDS.values()]
+
+# All data of a recipe
+ALL_FIELDS = RECIPE_FIELDS + EXTRA_FIELDS
+
+# Columns covered by the FULLTEXT index (see manage_db_offline.add_fulltext_index)
+FULLTEXT_COLUMNS = [Recipe.title, Recipe.contents, Recipe.ingredients, Recipe.source]
+
+# Words shorter than this are not indexed (innodb_ft_min_token_size)
+FULLTEXT_MIN_WORD_LENGTH = 3
+
+# Fields that reference a user and are replaced with user data in complete recipe data
+USER_REFERENCES = ["created_by", "changed_by"]
+
+# User data included in complete recipe data
+USER_FIELDS = [f for f in usermodel.User._meta.sorted_field_names if f != "password"]
+EMPTY_USER = {f: usermodel.User._meta.fields[f].default for f in USER_FIELDS}
 
 
 def add_recipe(data):
@@ -40,6 +81,8 @@ def add_recipe(data):
         source=data.get("source", ""),
         ingredients=data.get("ingredients", ""),
         contents=data.get("contents", ""),
+        ingredients_html=data.get("ingredients_html", ""),
+        contents_html=data.get("contents_html", ""),
         portions_text=data.get("portions_text", ""),
         portions=portions,
         created=datetime.datetime.now(),
@@ -55,84 +98,182 @@ def add_recipe(data):
     return recipe.id
 
 
-def get_recipe(recipe):
-    """Return data for one recipe."""
-    r = model_to_dict(recipe, recurse=False)
-    # Add user data
-    r["created_by"] = model_to_dict(recipe.a)
-    r["created_by"].pop("password")
-    if hasattr(recipe, "b"):
-        r["changed_by"] = model_to_dict(recipe.b)
-    else:
-        r["changed_by"] = model_to_dict(usermodel.User())
-    r["changed_by"].pop("password")
-    # Add tags
-    r["tags"] = sorted(recipe.taglist.split(",")) if recipe.taglist else []
-    # Add stored value
-    r["stored"] = recipe.stored.stored
-    return r
+def get_recipe(row):
+    """Return data for one recipe from a row selected with all columns for complete data."""
+    return next(iter_recipes([row], complete_data=True))
+
+
+def get_recipes(rows, complete_data=False, fields=None):
+    """Return list of recipes. Restrict data to fields if given."""
+    return list(iter_recipes(rows, complete_data, fields))
+
 
+def iter_recipes(rows, complete_data=False, fields=None):
+    """Convert rows from a .dicts() query into recipe data one by one. Restrict data to fields if given.
 
-def get_recipes(recipes, complete_data=False):
-    """Return list of recipes."""
-    data = []
-    for recipe in recipes:
-        r = model_to_dict(recipe, recurse=False)
+    The rows must contain the columns from select_columns, 'stored' and for complete data
+    the columns from user_columns.
+    """
+    if fields is None:
+        fields = ALL_FIELDS if complete_data else LISTING_FIELDS
+    columns = [f for f in RECIPE_FIELDS if f in fields]
+    users = [(ref, [(f"{ref}__{f}", f) for f in USER_FIELDS])
+             for ref in USER_REFERENCES if complete_data and ref in fields]
+    with_tags = "tags" in fields
+    with_stored = "stored" in fields
+
+    for row in rows:
+        r = {c: row[c] for c in columns}
 
         # Add tags
-        r["tags"] = sorted(recipe.taglist.split(",")) if recipe.taglist else []
-        data.append(r)
-
-        # Add stored values
-        r["stored"] = recipe.stored.stored
-
-        if complete_data:
-            # Add user data
-            r["created_by"] = model_to_dict(recipe.a)
-            r["created_by"].pop("password")
-            if hasattr(recipe, "b"):
-                r["changed_by"] = model_to_dict(recipe.b)
+        if with_tags:
+            r["tags"] = json.loads(row["taglist"]) if row["taglist"] else []
+
+        # Add stored value
+        if with_stored:
+            r["stored"] = row["stored"]
+
+        # Add user data
+        for ref, user_columns in users:
+            if row[ref] is None:
+                r[ref] = dict(EMPTY_USER)
             else:
-                r["changed_by"] = model_to_dict(usermodel.User())
-            r["changed_by"].pop("password")
-
-        else:
-            # Remove data not needed in listing
-            r.pop("contents")
-            r.pop("ingredients")
-            r.pop("portions")
-            r.pop("portions_text")
-            r.pop("source")
-            r.pop("suggester")
-            r.pop("created")
-            r.pop("created_by")
-            r.pop("changed")
-            r.pop("changed_by")
-            r.pop("needs_fix_text")
-
-    # Reverse list to display the newest recipe first
-    data.reverse()
-    return data
+                r[ref] = {f: row[c] for c, f in user_columns}
+
+        yield r
+
+
+def parse_fields(in_str):
+    """Parse comma separated list of requested fields. Raise ValueError for unknown fields."""
+    if not in_str:
+        return None
+    fields = ["id"]
+    for field in in_str.split(","):
+        field = field.strip()
+        if field not in RECIPE_FIELDS and field not in EXTRA_FIELDS:
+            raise ValueError(f"Unknown field: {field}")
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def select_columns(fields=None, complete_data=False):
+    """Get the Recipe columns needed to output fields (same defaults as iter_recipes)."""
+    if fields is None:
+        fields = ALL_FIELDS if complete_data else LISTING_FIELDS
+    columns = [f for f in Recipe._meta.sorted_fields if f.name in fields]
+    if "tags" in fields:
+        columns.append(Recipe.taglist)
+    return columns
+
+
+def has_tag(tagname):
+    """Create expression matching recipes with tagname in their tag list."""
+    return Recipe.taglist.contains(json.dumps(tagname, ensure_ascii=False))
+
+
+def text_search(searchitem, fulltext=False):
+    """Create expression matching recipes containing searchitem (word or phrase) in any text column.
+
+    With fulltext=True the FULLTEXT index is used (prefix match for words, exact match for phrases).
+    Search items containing words that are too short for the index are matched with LIKE.
+    """
+    if fulltext:
+        words = re.findall(r"\w+", searchitem)
+        if words and all(len(w) >= FULLTEXT_MIN_WORD_LENGTH for w in words):
+            against = '"%s"' % " ".join(words) if len(words) > 1 else words[0] + "*"
+            return Match(FULLTEXT_COLUMNS, against, "IN BOOLEAN MODE")
+    return reduce(pw.operator.or_, [column.contains(searchitem) for column in FULLTEXT_COLUMNS])
+
+
+def make_taglist(tagnames):
+    """Serialise tag names for the taglist column."""
+    return json.dumps(sorted(tagnames), ensure_ascii=False)
+
+
+def user_columns(user_model, ref):
+    """Get the user columns for a user reference in complete recipe data, e.g. 'created_by__username'."""
+    return [getattr(user_model, f).alias(f"{ref}__{f}") for f in USER_FIELDS]
+
+
+def paginate(query, order="newest", cursor=None, limit=None):
+    """Sort query and restrict it to the page after cursor (keyset pagination).
+
+    One more row than limit is selected to find out whether there is a next page (see split_page).
+    """
+    if order == "title":
+        query = query.select_extend(Recipe.title).order_by(Recipe.title, Recipe.id)
+        if cursor:
+            title, recipe_id = cursor
+            query = query.where((Recipe.title > title) | ((Recipe.title == title) & (Recipe.id > recipe_id)))
+    else:
+        query = query.order_by(Recipe.id.desc())
+        if cursor:
+            query = query.where(Recipe.id < cursor[0])
+    if limit:
+        query = query.limit(limit + 1)
+    return query
+
+
+def split_page(recipes, order="newest", limit=None):
+    """Cut off the extra row selected by paginate. Return the rows and the cursor for the next page."""
+    recipes = list(recipes)
+    if not limit or len(recipes) <= limit:
+        return recipes, None
+    recipes = recipes[:limit]
+    return recipes, make_cursor(recipes[-1], order)
+
+
+def make_cursor(recipe, order="newest"):
+    """Create cursor pointing at the page after recipe (a row from a .dicts() query)."""
+    values = [recipe["title"], recipe["id"]] if order == "title" else [recipe["id"]]
+    return encode_cursor(values)
+
+
+def encode_cursor(values):
+    """Encode a list of values as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("UTF-8")).decode("ascii")
+
+
+def decode_cursor(cursor, order="newest"):
+    """Decode a cursor created by make_cursor. Raise ValueError if it is invalid."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(values, list) or len(values) != (2 if order == "title" else 1):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if order == "title" and not isinstance(values[0], str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(values[-1], int) or isinstance(values[-1], bool):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if order == RELEVANCE and values[0] < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
 
 
 def edit_recipe(in_id, data):
     """Override data of an existing recipe. Find recipe by ID."""
-    recipe = Recipe.get(Recipe.id == in_id)
-    recipe.title = data.get("title")
-    recipe.url = data.get("url")
-    recipe.image = data.get("image", "")
-    recipe.source = data.get("source", "")
-    recipe.ingredients = data.get("ingredients", "")
-    recipe.contents = data.get("contents", "")
-    recipe.portions_text = portion_text_extend(data.get("portions_text", ""))
-    recipe.portions = portion_str_to_number(data.get("portions_text", ""))
-    recipe.changed_by = data.get("user")
-    recipe.changed = datetime.datetime.now()
-    recipe.published = data.get("published", True)
-    recipe.suggester = data.get("suggester", None)
-    recipe.needs_fix = data.get("needs_fix", False),
-    recipe.needs_fix_text = data.get("needs_fix_text", "")
-    recipe.save()
+    Recipe.update(
+        title=data.get("title"),
+        url=data.get("url"),
+        image=data.get("image", ""),
+        source=data.get("source", ""),
+        ingredients=data.get("ingredients", ""),
+        contents=data.get("contents", ""),
+        ingredients_html=data.get("ingredients_html", ""),
+        contents_html=data.get("contents_html", ""),
+        portions_text=portion_text_extend(data.get("portions_text", "")),
+        portions=portion_str_to_number(data.get("portions_text", "")),
+        changed_by=data.get("user"),
+        changed=datetime.datetime.now(),
+        published=data.get("published", True),
+        suggester=data.get("suggester", None),
+        needs_fix=data.get("needs_fix", False),
+        needs_fix_text=data.get("needs_fix_text", "")
+    ).where(Recipe.id == in_id).execute()
 
 
 def toggle_needs_fix(in_id, needs_fix):
@@ -144,18 +285,22 @@ def toggle_needs_fix(in_id, needs_fix):
     recipe.save()
 
 
+def get_image(in_id):
+    """Get the image file name of a recipe. Raise Recipe.DoesNotExist if there is no recipe with this ID."""
+    return Recipe.select(Recipe.image).where(Recipe.id == in_id).tuples().get()[0]
+
+
 def set_image(in_id, data):
     """Set image of recipe without changing any other data."""
-    recipe = Recipe.get(Recipe.id == in_id)
-    recipe.image = data.get("image", "")
-    recipe.save()
+    Recipe.update(image=data.get("image", "")).where(Recipe.id == in_id).execute()
 
 
-def set_url(in_id, url):
-    """Set URL of recipe without changing any other data."""
-    recipe = Recipe.get(Recipe.id == in_id)
-    recipe.url = url
-    recipe.save()
+def set_url(in_id, url, image=None):
+    """Set URL (and image file name if given) of recipe without changing any other data."""
+    fields = {"url": url}
+    if image is not None:
+        fields["image"] = image
+    Recipe.update(**fields).where(Recipe.id == in_id).execute()
 
 
 def delete_recipe(in_id):
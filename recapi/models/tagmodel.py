@@ -3,8 +3,8 @@
 import peewee as pw
 from playhouse.shortcuts import model_to_dict
 
-from recapi.models import BaseModel
-from recapi.models.recipemodel import Recipe
+from recapi.models import DATABASE, BaseModel
+from recapi.models.recipemodel import Recipe, make_taglist
 
 
 class TagCategory(BaseModel):
@@ -29,12 +29,25 @@ class RecipeTags(BaseModel):
 
 
 def add_tags(recipe_data, recipe_id):
-    """Add entries for Tag and RecipeTags and delete removed tags."""
+    """Add entries for Tag and RecipeTags, delete removed tags and update the recipe's tag list.
+
+    Return True if tags have been created or removed.
+    """
+    with DATABASE.atomic():
+        tags_changed = _add_tags(recipe_data, recipe_id)
+        update_taglist(recipe_id)
+    return tags_changed
+
+
+def _add_tags(recipe_data, recipe_id):
+    """Add entries for Tag and RecipeTags and delete removed tags. Return True if tags have been created or removed."""
+    tags_changed = False
     newTags = recipe_data.get("newTags", {})
     for tagname, category in newTags.items():
         tagname = tagname.lower().strip()
         tag = Tag(tagname=tagname, parent=TagCategory.get(TagCategory.categoryname == category))
         tag.save()
+        tags_changed = True
 
     # Get existing tags for recipe
     existing_tags_rows = RecipeTags.select().join(Tag, pw.JOIN.LEFT_OUTER).where((RecipeTags.recipeID == recipe_id))
@@ -49,7 +62,7 @@ def add_tags(recipe_data, recipe_id):
     for tagname in tags:
         tagname = tagname.lower().strip()
         if tagname not in existing_tags:
-            recipetags = RecipeTags(recipeID=Recipe.get(Recipe.id == recipe_id), tagID=Tag.get(Tag.tagname == tagname))
+            recipetags = RecipeTags(recipeID=recipe_id, tagID=Tag.get(Tag.tagname == tagname))
             recipetags.save()
 
     # Delete removed tags
@@ -58,53 +71,116 @@ def add_tags(recipe_data, recipe_id):
             recipetags = RecipeTags.get(RecipeTags.recipeID == recipe_id, RecipeTags.tagID == Tag.get(Tag.tagname == tagname).id)
             recipetags.delete_instance()
             # Remove this tag from Tag table if no other recipe uses it
-            delete_abandoned_tag(in_tagname=tagname)
+            tags_changed |= delete_abandoned_tag(in_tagname=tagname)
+    return tags_changed
 
 
 def delete_recipe(recipe_id):
-    """Remove all records belonging to a recipe."""
-    recipetags = RecipeTags.select().where(RecipeTags.recipeID == recipe_id)
-    for record in recipetags:
-        tagID = record.tagID
-        record.delete_instance()
-        delete_abandoned_tag(tag_instance=Tag.get(Tag.id == tagID))
+    """Remove all records belonging to a recipe. Return True if tags have been removed."""
+    tags_changed = False
+    with DATABASE.atomic():
+        recipetags = RecipeTags.select().where(RecipeTags.recipeID == recipe_id)
+        for record in recipetags:
+            tagID = record.tagID
+            record.delete_instance()
+            tags_changed |= delete_abandoned_tag(tag_instance=Tag.get(Tag.id == tagID))
+        update_taglist(recipe_id)
+    return tags_changed
+
+
+def get_taglist(recipe_id):
+    """Get the names of all tags of a recipe."""
+    tags = Tag.select(Tag.tagname).join(RecipeTags).where(RecipeTags.recipeID == recipe_id)
+    return [t.tagname for t in tags]
+
+
+def update_taglist(recipe_id):
+    """Store the recipe's tags in its tag list column."""
+    Recipe.update(taglist=make_taglist(get_taglist(recipe_id))).where(Recipe.id == recipe_id).execute()
 
 
 def delete_abandoned_tag(in_tagname="", tag_instance=None):
-    """Remove tag from database (by name or peewee instance) if there are no references of it left in RecipeTags."""
+    """Remove tag from database (by name or peewee instance) if there are no references of it left in RecipeTags.
+
+    Return True if the tag has been removed.
+    """
     if not tag_instance:
         tag_instance = Tag.get(Tag.tagname == in_tagname)
     recipetags = RecipeTags.select().where(RecipeTags.tagID == tag_instance.id).count()
     if recipetags == 0:
         tag_instance.delete_instance()
+        return True
+    return False
+
 
+def get_tag_map():
+    """Get {tagname: (tag ID, category ID)} for all tags."""
+    tags = Tag.select(Tag.id, Tag.tagname, Tag.parent).tuples()
+    return {tagname: (tag_id, category_id) for tag_id, tagname, category_id in tags}
 
-def get_tag_categories():
-    """Get a list of tag categories."""
-    categories = TagCategory.select()
+
+def has_any_tag(tag_ids):
+    """Create expression matching recipes that have at least one of the tags in tag_ids."""
+    return Recipe.id.in_(RecipeTags.select(RecipeTags.recipeID).where(RecipeTags.tagID.in_(list(tag_ids))))
+
+
+def get_tag_counts(recipe_ids=None):
+    """Get {tag ID: number of recipes} for the published recipes (or the recipes selected by the query recipe_ids)."""
+    if recipe_ids is None:
+        recipe_ids = Recipe.select(Recipe.id).where(Recipe.published == True)
+    counts = RecipeTags.select(
+        RecipeTags.tagID, pw.fn.COUNT(RecipeTags.recipeID)
+    ).where(
+        RecipeTags.recipeID.in_(recipe_ids)
+    ).group_by(RecipeTags.tagID).tuples()
+    return dict(counts)
+
+
+def get_tag_rows():
+    """Get (category name, tag ID, tag name) for all categories and their tags, ordered by category order and tag name.
+
+    The tag ID and name are None for categories without tags.
+    """
+    rows = TagCategory.select(
+        TagCategory.categoryname, Tag.id, Tag.tagname
+    ).join(
+        Tag, pw.JOIN.LEFT_OUTER, on=(Tag.parent == TagCategory.id)
+    ).order_by(
+        TagCategory.categoryorder, TagCategory.id, Tag.tagname
+    ).tuples()
+    return list(rows)
+
+
+def get_tag_categories(rows=None):
+    """Get a list of tag categories. Use the rows from get_tag_rows if given."""
+    if rows is None:
+        rows = get_tag_rows()
     data = []
-    for category in categories:
-        catname = category.categoryname
-        data.append(catname)
+    for catname, _tag_id, _tagname in rows:
+        if not data or data[-1] != catname:
+            data.append(catname)
     return data
 
 
-def get_tag_structure(simple=False):
-    """Get all categories, their tags and the number of recipies per tag."""
+def get_tag_structure(simple=False, counts=False, rows=None):
+    """Get all categories, their tags and (if counts is set) the number of published recipes per tag.
+
+    Use the rows from get_tag_rows if given.
+    """
+    if rows is None:
+        rows = get_tag_rows()
+    tag_counts = get_tag_counts() if counts and not simple else {}
     data = []
-    categories = TagCategory.select()
-    tags = Tag.select().join(TagCategory)
-    for category in categories:
-        catname = category.categoryname
-        thesetags = tags.where(TagCategory.categoryname == catname)
+    for catname, tag_id, tagname in rows:
+        if not data or data[-1]["category"] != catname:
+            data.append({"category": catname, "tags": []})
+        if tag_id is None:
+            continue
         if simple:
-            taglist = sorted(t.tagname for t in thesetags)
+            data[-1]["tags"].append(tagname)
         else:
-            taglist = [{"name": t.tagname} for t in thesetags]
-        # Todo: Get amount of recipies for earch tag
-        thiscat = {
-            "category": catname,
-            "tags": taglist
-        }
-        data.append(thiscat)
+            tagdata = {"name": tagname}
+            if counts:
+                tagdata["count"] = tag_counts.get(tag_id, 0)
+            data[-1]["tags"].append(tagdata)
     return data
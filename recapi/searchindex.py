@@ -0,0 +1,480 @@
+"""In-process inverted index for searching recipes.
+
+The index covers the published recipes and is kept up to date with the change log
+(see recapi.cache.Catalogue). Texts are tokenised with normalise and tokenise, and
+every term points to the recipes and positions where it occurs.
+"""
+
+import bisect
+import json
+import math
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+import peewee as pw
+from markupsafe import escape
+
+from recapi.cache import catalogue
+from recapi.models import changemodel, recipemodel, tagmodel
+from recapi.models.usermodel import User
+
+# Indexed fields (searched in this order)
+FIELDS = ["title", "tags", "ingredients", "contents", "source", "user"]
+
+# Weight of a term occurring in a field when ranking search results
+FIELD_BOOSTS = {"title": 3.0, "tags": 2.0, "ingredients": 1.0, "contents": 0.7, "source": 0.5, "user": 0.5}
+
+# BM25 parameters (term frequency saturation and field length normalisation)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Suggestion types in the order they are listed by /suggest_terms
+SUGGESTION_TYPES = ["tag", "title", "ingredient"]
+# Maximum number of index entries looked at per suggestion request
+SUGGEST_SCAN = 500
+# Shortest ingredient word that is suggested
+MIN_SUGGEST_WORD_LENGTH = 3
+
+# Fields whose terms can be found by fuzzy search, shortest term that is fuzzy matched and
+# the share of trigrams (Jaccard similarity) a term must have in common with a fuzzy match
+FUZZY_FIELDS = ["title", "tags", "ingredients"]
+FUZZY_MIN_LENGTH = 4
+FUZZY_MIN_SIMILARITY = 0.3
+
+# Shortest term that is also matched inside indexed terms (e.g. "gryta" in "kycklinggryta")
+INFIX_MIN_LENGTH = 3
+
+# Fields that snippets are taken from (preferred first) and their length in tokens
+SNIPPET_FIELDS = ["contents", "ingredients", "title", "tags", "source"]
+SNIPPET_TOKENS = 20
+
+# Suffixes removed by stem (longest first), based on step 1 of the Snowball stemmer for Swedish
+# (without the participle endings -ad/-at that cut off words like "tomat", plus the neuter -et/-ena)
+SUFFIXES = sorted([
+    "a", "arna", "erna", "heterna", "orna", "e", "ade", "ande", "arne", "are", "aste", "en", "anden",
+    "aren", "heten", "ern", "ar", "er", "heter", "or", "as", "arnas", "ernas", "ornas", "es", "ades", "andes",
+    "ens", "arens", "hetens", "erns", "andet", "het", "ast", "et", "ena"
+], key=len, reverse=True)
+# Shortest stem left after removing a suffix
+MIN_STEM_LENGTH = 3
+
+
+def normalise(text):
+    """Lower-case text and fold diacritics (same folding as utils.make_url)."""
+    text = text.lower().replace("ß", "ss")
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("UTF-8")
+
+
+def stem(word):
+    """Remove the longest inflectional suffix from word (light Swedish stemming)."""
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenise(text):
+    """Split text into normalised and stemmed terms."""
+    return [term for term, _start, _end in tokenise_spans(text)]
+
+
+def tokenise_spans(text):
+    """Split text into normalised and stemmed terms. Return (term, start, end) with offsets in text."""
+    spans = []
+    for match in re.finditer(r"\w+", text or ""):
+        for word in re.findall(r"[a-z0-9]+", normalise(match.group())):
+            spans.append((stem(word), match.start(), match.end()))
+    return spans
+
+
+def trigrams(term):
+    """Get the set of character trigrams of term (padded to mark the beginning and end)."""
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def infix_trigrams(term):
+    """Get the set of character trigrams of term (without padding, so they also occur in longer terms)."""
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def edit_distance(a, b, max_distance):
+    """Get the Levenshtein distance between a and b, or max_distance + 1 if it is larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+def parse_query(q):
+    """Split a search string into search items (a quoted string is one item) and tokenise them."""
+    q = q.strip()
+    if len(q) > 1 and q.startswith('"') and q.endswith('"'):
+        searchitems = [q[1:-1]]
+    else:
+        searchitems = q.split()
+    return [terms for terms in (tokenise(item) for item in searchitems) if terms]
+
+
+class SearchIndex(object):
+    """Inverted index over the published recipes.
+
+    postings maps a term to {recipe ID: {field: [positions]}}. For ranking and snippets the
+    text and token offsets of every field are kept in texts, and the summed field lengths in
+    field_lengths. The index is (re)built lazily: changes reported by the catalogue only mark
+    recipes as stale, and these are re-read from the data base the next time the index is used.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = defaultdict(dict)
+        self.documents = {}  # recipe ID -> set of terms
+        self.texts = {}      # recipe ID -> {field: (text, [(start, end) for each position])}
+        self.field_lengths = dict.fromkeys(FIELDS, 0)
+        self.trigrams = defaultdict(set)  # trigram -> terms occurring in FUZZY_FIELDS
+        self.fuzzy_terms = defaultdict(int)  # term -> number of recipes with the term in FUZZY_FIELDS
+        self.infixes = defaultdict(set)  # trigram -> all terms containing it (see infix_trigrams)
+        self.terms = []      # sorted list of all terms
+        self.terms_dirty = False
+        self.stale = True    # the whole index needs to be built
+        self.pending = set() # recipe IDs that need to be re-read
+
+    def invalidate(self, changes=None, _version=None):
+        """Mark changed recipes as stale. Subscriber for the catalogue."""
+        with self.lock:
+            if changes is None:
+                self.stale = True
+                self.pending.clear()
+            else:
+                self.pending.update(recipe_id for recipe_id, kind in changes
+                                    if kind == changemodel.RECIPE and recipe_id is not None)
+
+    def refresh(self):
+        """Build the index or re-read stale recipes."""
+        with self.lock:
+            if self.stale:
+                self.postings.clear()
+                self.documents.clear()
+                self.texts.clear()
+                self.field_lengths = dict.fromkeys(FIELDS, 0)
+                self.trigrams.clear()
+                self.fuzzy_terms.clear()
+                self.infixes.clear()
+                for row in self._load():
+                    self._add(row)
+                self.stale = False
+                self.pending.clear()
+                self.terms_dirty = True
+            elif self.pending:
+                ids = list(self.pending)
+                for recipe_id in ids:
+                    self._remove(recipe_id)
+                for row in self._load(ids):
+                    self._add(row)
+                self.pending.clear()
+                self.terms_dirty = True
+            if self.terms_dirty:
+                self.terms = sorted(self.postings)
+                self.terms_dirty = False
+
+    def search(self, q, fuzzy=False):
+        """Return the set of IDs of the recipes matching all search items in q.
+
+        Every term matches the indexed terms that start with it or contain it, e.g. the second half of
+        a compound (and with fuzzy=True also similarly spelled terms). Terms of a multi-word (quoted) search item must occur in a row.
+        """
+        self.refresh()
+        with self.lock:
+            return self._match(self._resolve(q, fuzzy))
+
+    def rank(self, q, fuzzy=False):
+        """Return IDs of the recipes matching q, ordered by relevance (BM25 with field boosts)."""
+        self.refresh()
+        with self.lock:
+            query = self._resolve(q, fuzzy)
+            matches = self._match(query)
+            if not matches:
+                return []
+            scores = dict.fromkeys(matches, 0.0)
+            n_docs = len(self.documents)
+            for term in {indexed for variants in query for terms in variants for indexed in terms}:
+                postings = self.postings[term]
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for recipe_id in matches.intersection(postings):
+                    for field, positions in postings[recipe_id].items():
+                        avg_length = self.field_lengths[field] / n_docs
+                        length = len(self.texts[recipe_id][field][1])
+                        tf = len(positions)
+                        norm = 1 - BM25_B + BM25_B * length / avg_length
+                        scores[recipe_id] += FIELD_BOOSTS[field] * idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+            return sorted(scores, key=lambda recipe_id: (-scores[recipe_id], -recipe_id))
+
+    def snippets(self, q, ids, fuzzy=False):
+        """Get {recipe ID: snippet} with the terms of q highlighted (<em>) for the recipes in ids.
+
+        A snippet is a short HTML-escaped excerpt of the field with the most matching terms.
+        """
+        with self.lock:
+            expanded = {indexed for variants in self._resolve(q, fuzzy) for terms in variants for indexed in terms}
+            return {recipe_id: self._snippet(recipe_id, expanded) for recipe_id in ids if recipe_id in self.texts}
+
+    def _snippet(self, recipe_id, terms):
+        """Create a snippet for a recipe around the first occurrence of any of terms."""
+        matched = defaultdict(set)
+        for term in terms & self.documents[recipe_id]:
+            for field, positions in self.postings[term][recipe_id].items():
+                matched[field].update(positions)
+        fields = [f for f in SNIPPET_FIELDS if matched.get(f)]
+        if not fields:
+            return None
+        field = max(fields, key=lambda f: len(matched[f]))
+        text, spans = self.texts[recipe_id][field]
+        start = max(0, min(matched[field]) - SNIPPET_TOKENS // 4)
+        end = min(len(spans), start + SNIPPET_TOKENS)
+        parts = ["…"] if start > 0 else []
+        offset = spans[start][0]
+        for pos in sorted(p for p in matched[field] if start <= p < end):
+            pos_start, pos_end = spans[pos]
+            if pos_start < offset:
+                continue
+            parts.append(escape(text[offset:pos_start]))
+            parts.append(f"<em>{escape(text[pos_start:pos_end])}</em>")
+            offset = pos_end
+        parts.append(escape(text[offset:spans[end - 1][1]]))
+        if end < len(spans):
+            parts.append("…")
+        return {"field": field, "text": "".join(parts)}
+
+    def _resolve(self, q, fuzzy=False):
+        """Parse q and replace every term with the indexed terms it matches.
+
+        Return one list per search item, containing a list of indexed terms for every term.
+        """
+        return [[self._variants(term, fuzzy) for term in terms] for terms in parse_query(q)]
+
+    def _variants(self, term, fuzzy=False):
+        """Get the indexed terms starting with or containing term, and with fuzzy=True also the similar ones."""
+        start = bisect.bisect_left(self.terms, term)
+        end = bisect.bisect_left(self.terms, term + "\x7f", start)
+        variants = set(self.terms[start:end])
+        if len(term) >= INFIX_MIN_LENGTH:
+            variants.update(self._containing(term))
+        if fuzzy and len(term) >= FUZZY_MIN_LENGTH:
+            variants.update(self._similar(term))
+        return sorted(variants)
+
+    def _containing(self, term):
+        """Get the indexed terms containing term.
+
+        Candidates are the terms that have all trigrams of term, starting with the rarest trigram.
+        """
+        candidates = None
+        for trigram in sorted(infix_trigrams(term), key=lambda t: len(self.infixes.get(t, ()))):
+            terms = self.infixes.get(trigram, set())
+            candidates = set(terms) if candidates is None else candidates & terms
+            if not candidates:
+                return []
+        return [candidate for candidate in candidates if term in candidate]
+
+    def _similar(self, term):
+        """Get indexed terms (from FUZZY_FIELDS) within a small edit distance of term.
+
+        Candidates are the terms sharing enough trigrams with term, so the cost depends on the
+        number of candidates rather than on the size of the index.
+        """
+        max_distance = 1 if len(term) <= 5 else 2
+        term_trigrams = trigrams(term)
+        shared = defaultdict(int)
+        for trigram in term_trigrams:
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        similar = []
+        for candidate, n in shared.items():
+            if n / (len(term_trigrams) + len(trigrams(candidate)) - n) < FUZZY_MIN_SIMILARITY:
+                continue
+            distance = min(edit_distance(term, candidate, max_distance),
+                           edit_distance(term, candidate[:len(term)], max_distance))
+            if distance <= max_distance:
+                similar.append(candidate)
+        return similar
+
+    def _match(self, query):
+        """Get IDs of the recipes matching all search items in query (see _resolve)."""
+        result = None
+        for variants in query:
+            matches = self._match_phrase(variants)
+            result = matches if result is None else result & matches
+            if not result:
+                return set()
+        return result or set()
+
+    def _positions(self, terms):
+        """Get {(recipe ID, field): set of positions} for all indexed terms in terms."""
+        positions = defaultdict(set)
+        for indexed in terms:
+            for recipe_id, fields in self.postings[indexed].items():
+                for field, pos in fields.items():
+                    positions[(recipe_id, field)].update(pos)
+        return positions
+
+    def _match_phrase(self, variants):
+        """Get IDs of the recipes where the terms of a search item occur in a row in one field."""
+        candidates = self._positions(variants[0])
+        for offset, terms in enumerate(variants[1:], start=1):
+            following = self._positions(terms)
+            matched = {}
+            for key, positions in candidates.items():
+                positions = {p for p in positions if p + offset in following.get(key, ())}
+                if positions:
+                    matched[key] = positions
+            candidates = matched
+        return {recipe_id for recipe_id, _field in candidates}
+
+    def _add(self, row):
+        """Add a recipe (a row from _load) to the index."""
+        recipe_id = row["id"]
+        document = set()
+        texts = {}
+        for field in FIELDS:
+            text = row[field] or ""
+            if field == "tags":
+                text = ", ".join(json.loads(text or "[]"))
+            spans = tokenise_spans(text)
+            for pos, (term, _start, _end) in enumerate(spans):
+                self.postings[term].setdefault(recipe_id, {}).setdefault(field, []).append(pos)
+                document.add(term)
+            texts[field] = (text, [(start, end) for _term, start, end in spans])
+            self.field_lengths[field] += len(spans)
+        for term in document:
+            if len(self.postings[term]) == 1:
+                for trigram in infix_trigrams(term):
+                    self.infixes[trigram].add(term)
+            if any(field in FUZZY_FIELDS for field in self.postings[term][recipe_id]):
+                if not self.fuzzy_terms[term]:
+                    for trigram in trigrams(term):
+                        self.trigrams[trigram].add(term)
+                self.fuzzy_terms[term] += 1
+        self.documents[recipe_id] = document
+        self.texts[recipe_id] = texts
+
+    def _remove(self, recipe_id):
+        """Remove a recipe from the index."""
+        for term in self.documents.pop(recipe_id, ()):
+            fields = self.postings[term].pop(recipe_id, {})
+            if any(field in FUZZY_FIELDS for field in fields):
+                self.fuzzy_terms[term] -= 1
+                if not self.fuzzy_terms[term]:
+                    del self.fuzzy_terms[term]
+                    for trigram in trigrams(term):
+                        self.trigrams[trigram].discard(term)
+            if not self.postings[term]:
+                del self.postings[term]
+                for trigram in infix_trigrams(term):
+                    self.infixes[trigram].discard(term)
+                    if not self.infixes[trigram]:
+                        del self.infixes[trigram]
+        for field, (_text, spans) in self.texts.pop(recipe_id, {}).items():
+            self.field_lengths[field] -= len(spans)
+
+    def _load(self, ids=None):
+        """Get the indexed fields of the published recipes (restricted to ids)."""
+        query = recipemodel.Recipe.select(
+            recipemodel.Recipe.id,
+            recipemodel.Recipe.title,
+            recipemodel.Recipe.taglist.alias("tags"),
+            recipemodel.Recipe.ingredients,
+            recipemodel.Recipe.contents,
+            recipemodel.Recipe.source,
+            User.username.alias("user")
+        ).join(
+            User, pw.JOIN.LEFT_OUTER, on=(User.id == recipemodel.Recipe.created_by)
+        ).where(
+            recipemodel.Recipe.published == True
+        )
+        if ids is not None:
+            query = query.where(recipemodel.Recipe.id.in_(ids))
+        return query.dicts().iterator()
+
+
+class SuggestionIndex(object):
+    """Sorted array of normalised keys for prefix lookups (typeahead).
+
+    The entries are titles (once for every word they contain, so that a title can be found
+    by any of its words), tags and words from the ingredient lists. They are rebuilt from the
+    search index and the Tag table the first time suggestions are needed after a change.
+    """
+
+    def __init__(self, search_index):
+        self.search_index = search_index
+        self.lock = threading.Lock()
+        self.keys = []     # sorted normalised keys
+        self.entries = []  # (type, text, weight) for every key
+        self.stale = True
+
+    def invalidate(self, _changes=None, _version=None):
+        """Mark suggestions as stale. Subscriber for the catalogue."""
+        self.stale = True
+
+    def refresh(self):
+        """Rebuild the suggestions if they are stale."""
+        self.search_index.refresh()
+        with self.lock:
+            if not self.stale:
+                return
+            self.stale = False
+            entries = []
+            ingredients = defaultdict(set)
+            with self.search_index.lock:
+                for recipe_id, texts in self.search_index.texts.items():
+                    title = texts["title"][0]
+                    for match in re.finditer(r"\w+", title):
+                        entries.append((normalise(title[match.start():]), ("title", title, 1)))
+                    for word in re.findall(r"[^\W\d_]+", texts["ingredients"][0].lower()):
+                        if len(word) >= MIN_SUGGEST_WORD_LENGTH:
+                            ingredients[word].add(recipe_id)
+            entries.extend((normalise(word), ("ingredient", word, len(ids))) for word, ids in ingredients.items())
+            tags = tagmodel.Tag.select(
+                tagmodel.Tag.tagname, pw.fn.COUNT(tagmodel.RecipeTags.id).alias("n")
+            ).join(
+                tagmodel.RecipeTags, pw.JOIN.LEFT_OUTER, on=(tagmodel.RecipeTags.tagID == tagmodel.Tag.id)
+            ).group_by(tagmodel.Tag.id).dicts()
+            entries.extend((normalise(tag["tagname"]), ("tag", tag["tagname"], tag["n"])) for tag in tags)
+            entries.sort(key=lambda entry: entry[0])
+            self.keys = [key for key, _entry in entries]
+            self.entries = [entry for _key, entry in entries]
+
+    def suggest(self, prefix, limit=10):
+        """Get up to limit suggestions starting with prefix as (type, text).
+
+        At most SUGGEST_SCAN index entries are looked at, so that the response time does not
+        depend on the size of the catalogue. Tags come first, then titles and ingredients,
+        each ordered by how many recipes they occur in.
+        """
+        prefix = normalise(prefix).strip()
+        if not prefix:
+            return []
+        self.refresh()
+        with self.lock:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + "\x7f", start, min(len(self.keys), start + SUGGEST_SCAN))
+            candidates = {}
+            for kind, text, weight in self.entries[start:end]:
+                candidates[(kind, text)] = candidates.get((kind, text), 0) + weight
+        ranked = sorted(candidates, key=lambda c: (SUGGESTION_TYPES.index(c[0]), -candidates[c], c[1]))
+        return ranked[:limit]
+
+
+search_index = SearchIndex()
+catalogue.subscribe(search_index.invalidate)
+
+suggestion_index = SuggestionIndex(search_index)
+catalogue.subscribe(suggestion_index.invalidate)
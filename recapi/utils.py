@@ -1,10 +1,12 @@
 """Collection of utilities and auxiliaries."""
 
 import functools
+import hashlib
 import json
 import os
 import re
 import shutil
+import threading
 import time
 import traceback
 import unicodedata
@@ -15,17 +17,23 @@ from subprocess import PIPE, Popen
 import bleach
 import markdown
 from bleach_whitelist import markdown_attrs, markdown_tags
-from flask import current_app, jsonify, session
+from flask import current_app, jsonify, request, session, stream_with_context
+from flask import json as flask_json
 from PIL import Image
 from validator_collection import checkers
 from werkzeug.datastructures import FileStorage
 
+from recapi.cache import catalogue
+
 IMAGE_FORMATS = {
     "image/jpeg": "jpg",
     "image/png": "png",
     "image/gif": "gif"
 }
 
+THUMBNAIL_SIZE = 512, 512
+MEDIUM_IMAGE_SIZE = 1110, 1110
+
 
 def error_response(msg):
     """Create json error response."""
@@ -46,16 +54,112 @@ def success_response(msg, **kwargs):
     return jsonify(response)
 
 
+def success_payload(msg, **kwargs):
+    """Create serialised json success response (e.g. for caching)."""
+    response = {
+        "status": "success",
+        "message": msg
+    }
+    for key, value in kwargs.items():
+        response[key] = value
+    return flask_json.dumps(response) + "\n"
+
+
+def payload_response(payload):
+    """Create json response from a serialised payload."""
+    return current_app.response_class(payload, mimetype="application/json")
+
+
+def stream_response(msg, rows, trailer=None, ndjson=False, chunk_size=65536):
+    """Create streamed json success response from an iterator over rows.
+
+    The envelope is the same as in success_response, but 'hits' and the values returned by
+    trailer() come after 'data' since they are only known when all rows have been serialised.
+    With ndjson=True every row is written on a line of its own, followed by a line with the envelope.
+    """
+    def generate():
+        hits = 0
+        buffer = []
+        buffered = 0
+        if not ndjson:
+            head = flask_json.dumps({"status": "success", "message": msg})
+            buffer.append(head[:-1] + ', "data": [')
+        for row in rows:
+            row = flask_json.dumps(row)
+            if ndjson:
+                row += "\n"
+            elif hits:
+                row = "," + row
+            buffer.append(row)
+            buffered += len(row)
+            hits += 1
+            if buffered >= chunk_size:
+                yield "".join(buffer)
+                buffer = []
+                buffered = 0
+        tail = {"hits": hits}
+        if trailer:
+            tail.update(trailer())
+        if ndjson:
+            tail = dict({"status": "success", "message": msg}, **tail)
+            buffer.append(flask_json.dumps(tail) + "\n")
+        else:
+            buffer.append("], " + flask_json.dumps(tail)[1:] + "\n")
+        yield "".join(buffer)
+
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    return current_app.response_class(stream_with_context(generate()), mimetype=mimetype)
+
+
+class MarkdownRenderer(object):
+    """Convert markdown to sanitised html.
+
+    Markdown instances and bleach Cleaners are not thread-safe, so every thread builds its own
+    pair once and reuses it (the Markdown instance is reset after each conversion).
+    """
+
+    def __init__(self, tags=markdown_tags, attributes=markdown_attrs, extensions=()):
+        self.tags = list(tags)
+        self.attributes = dict(attributes)
+        self.extensions = list(extensions)
+        self.local = threading.local()
+
+    def render(self, text):
+        """Convert one markdown text to html."""
+        if not hasattr(self.local, "markdown"):
+            self.local.markdown = markdown.Markdown(extensions=self.extensions)
+            self.local.cleaner = bleach.sanitizer.Cleaner(tags=self.tags, attributes=self.attributes)
+        md = self.local.markdown
+        try:
+            html = md.convert(text)
+        finally:
+            md.reset()
+        return self.local.cleaner.clean(html)
+
+    def render_many(self, texts):
+        """Convert a list of markdown texts to html."""
+        return [self.render(text) for text in texts]
+
+
+md_renderer = MarkdownRenderer()
+
+
 def md2html(data):
     """Convert markdown to html."""
-    html = bleach.clean(markdown.markdown(data), markdown_tags, markdown_attrs)
-    return html
+    return md_renderer.render(data)
 
 
 def recipe2html(recipe):
     """Convert markdown recipe fields into html."""
-    recipe["ingredients"] = md2html(recipe.get("ingredients", ""))
-    recipe["contents"] = md2html(recipe.get("contents", ""))
+    recipe["ingredients"], recipe["contents"] = md_renderer.render_many(
+        [recipe.get("ingredients", ""), recipe.get("contents", "")])
+    return recipe
+
+
+def render_html(recipe):
+    """Render the markdown recipe fields into their HTML columns (e.g. 'ingredients_html')."""
+    recipe["ingredients_html"], recipe["contents_html"] = md_renderer.render_many(
+        [recipe.get("ingredients", ""), recipe.get("contents", "")])
     return recipe
 
 
@@ -143,18 +247,26 @@ def save_downscaled(src, destfolder, thumbnail=False, overwrite=True):
         if (overwrite is False) and os.path.exists(outpath):
             return
 
-        if thumbnail:
-            size = 512, 512
-        else:
-            size = 1110, 1110
-        im = Image.open(src)
-        im.thumbnail(size)
-        im.save(outpath, "JPEG")
+        size = THUMBNAIL_SIZE if thumbnail else MEDIUM_IMAGE_SIZE
+        downscale(src, destfolder, size)
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
         raise e
 
 
+def downscale(src, destfolder, size):
+    """Downscale image src to fit into size and save it as jpg in destfolder.
+
+    Does not depend on the app context so it can be run in worker processes.
+    """
+    file, _ext = os.path.splitext(os.path.basename(src))
+    outpath = os.path.join(destfolder, file + ".jpg")
+    im = Image.open(src)
+    im.thumbnail(size)
+    im.save(outpath, "JPEG")
+    return outpath
+
+
 def valid_url(url):
     """Check if input is a valid url."""
     return checkers.is_url(url)
@@ -224,6 +336,27 @@ def gatekeeper(allow_guest=False):
     return decorator
 
 
+def catalogue_etag(function):
+    """Add ETag derived from the catalogue version to response and answer with 304 if it is unchanged.
+
+    Use as decorator for routes whose response only depends on the catalogue and the request URL.
+    Such routes must not return errors with status 200, or the error is cached by the client.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        version = catalogue.sync()
+        etag = hashlib.sha1(f"{version}:{request.full_path}".encode("UTF-8")).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        response = current_app.make_response(function(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+        return response
+    return wrapper
+
+
 def make_url(title, recipe_id):
     """Create a pretty URL from the recipe title and it's numeric ID."""
     title = title.lower()
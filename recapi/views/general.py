@@ -4,8 +4,9 @@ import os
 import traceback
 
 from flask import send_from_directory, request, current_app, Blueprint
+from werkzeug.utils import safe_join
 
-from recapi import utils
+from recapi import images, utils
 
 bp = Blueprint("general", __name__)
 
@@ -43,6 +44,25 @@ def send_img(filename):
     return send_from_directory(image_dir, filename, mimetype="image/jpeg")
 
 
+@bp.route("/img/<int:size>/<filename>")
+def send_resized_img(size, filename):
+    """Serve image downscaled to one of the configured widths."""
+    if size not in current_app.config.get("IMAGE_SIZES", []):
+        return utils.error_response(f"Unsupported image size: {size}."), 400
+    image_dir = os.path.join(current_app.instance_path,
+                             current_app.config.get("IMAGE_PATH"))
+    src = safe_join(image_dir, filename)
+    if src is None or not os.path.isfile(src):
+        return utils.error_response("Image not found."), 404
+    try:
+        cache_dir = os.path.join(current_app.instance_path, current_app.config.get("IMAGE_CACHE_PATH"))
+        path = images.derivative_cache.get(src, cache_dir, size, current_app.config.get("IMAGE_CACHE_BYTES"))
+        return send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype="image/jpeg")
+    except Exception as e:
+        current_app.logger.error(traceback.format_exc())
+        return utils.error_response(f"Could not resize image: {e}"), 500
+
+
 @bp.route("/img/tmp/<filename>")
 def send_tmp(filename):
     """Serve temporary files."""
@@ -1,10 +1,7 @@
 """Routes and utilities for html parsing."""
 
-import importlib
 import io
 import os
-import pkgutil
-import re
 import traceback
 import urllib.parse
 from urllib.request import Request, urlopen
@@ -12,11 +9,14 @@ from urllib.request import Request, urlopen
 import requests
 from flask import Blueprint, current_app, request
 from PIL import Image
-from recapi import html_parsers, utils
-from recapi.html_parsers import GeneralParser
+from recapi import utils
+from recapi.html_parsers import registry
 
 bp = Blueprint("parser_views", __name__)
 
+# Import all parsers once
+registry.load()
+
 
 @bp.route("/parse_from_url")
 def parse_from_url():
@@ -27,12 +27,7 @@ def parse_from_url():
     if not utils.valid_url(url):
         return utils.error_response(f"Invalid URL: {url}."), 400
 
-    import_parsers()
-
-    # Collect all parser classes
-    all_parsers = [parser for parser in GeneralParser.__subclasses__()]
-
-    p = find_parser(all_parsers, url)
+    p = registry.find(url)
     if p:
         recipe = {}
         parser = p(url)
@@ -52,43 +47,13 @@ def parse_from_url():
 @bp.route("/get_parsers")
 def get_parsers():
     """Get a list of recipe pages for which there is a parser available."""
-    import_parsers()
     try:
-        pages_list = [{"domain": p.domain,
-                       "name": p.name,
-                       "address": p.address} for p in GeneralParser.__subclasses__()]
-        return utils.success_response("Successfully retrieved list of parsable pages.", data=pages_list)
+        return utils.success_response("Successfully retrieved list of parsable pages.", data=registry.metadata)
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Could not retrieve list of parsable pages: {e}"), 500
 
 
-def import_parsers():
-    """Import all modules from html_parsers sub package."""
-    parser_module_path = os.path.dirname(html_parsers.__file__)
-    for (_module_loader, name, _ispkg) in pkgutil.iter_modules([parser_module_path]):
-        importlib.import_module(f"{html_parsers.__name__}.{name}", __package__)
-
-
-def find_parser(parsers, url):
-    """Find parser that can parse url."""
-    domain = extract_domain(url)
-
-    # Create domain dict
-    domain_dict = {}
-    for p in parsers:
-        domain_dict[p.domain] = p
-
-    return domain_dict.get(domain)
-
-
-def extract_domain(url):
-    """Extract domain name from url."""
-    pattern = r"^(?:https?://)?(?:[\w\.]+\.)?(\w+\.\w+)(?:/|$)"
-    match = re.search(pattern, url)
-    return match.group(1)
-
-
 def download_image(image_url):
     """Retrieve image from URL and save it as a temporary file."""
     try:
@@ -3,23 +3,77 @@
 import os
 import random
 import traceback
+from collections import defaultdict
 from functools import reduce
 
 import peewee as pw
 from flask import Blueprint, current_app, request, session
 
 from recapi import utils
-from recapi.models import recipemodel, storedmodel, tagmodel
+from recapi.cache import LRUCache, catalogue
+from recapi.models import DATABASE, changemodel, recipemodel, storedmodel, tagmodel
 from recapi.models.usermodel import User
+from recapi.searchindex import parse_query, search_index, suggestion_index
 
 bp = Blueprint("recipe_data", __name__)
 
+# Serialised responses of get_recipe_data, dropped on every change
+listing_cache = LRUCache(maxsize=64)
+catalogue.subscribe(listing_cache.clear)
+
+# Tag data (see get_tag_map and get_tag_rows), dropped when tags are created or removed
+tag_cache = LRUCache(maxsize=8)
+
+# IDs of the recipes found by /search, dropped on every change
+search_cache = LRUCache(maxsize=256, ttl=600)
+catalogue.subscribe(search_cache.clear)
+
+# Recipe rows (see get_recipe_rows), dropped when the recipe changes
+recipe_cache = LRUCache(maxsize=2048)
+catalogue.subscribe(recipe_cache.forget_recipes)
+
+# Responses of /recipe/<slug> (URL and serialised payload per recipe ID), dropped when the recipe changes
+recipe_json_cache = LRUCache(maxsize=512)
+recipe_html_cache = LRUCache(maxsize=512)
+catalogue.subscribe(recipe_json_cache.forget_recipes)
+catalogue.subscribe(recipe_html_cache.forget_recipes)
+
+# Recipe IDs per URL (checked against the cached recipe's URL)
+url_cache = LRUCache(maxsize=2048)
+
+# IDs of the recipes /random can choose from (per tag set), dropped on every change
+random_cache = LRUCache(maxsize=16)
+catalogue.subscribe(random_cache.clear)
+
+# Maximum number of recipes requested from /get_recipes at once
+MAX_BATCH = 500
+
+# Maximum number of recipes returned by /random
+MAX_RANDOM = 50
+
+# Number of rows read per query when a listing is streamed
+STREAM_PAGE_SIZE = 500
+
+# Sort order for searches answered from the search index
+RELEVANCE = recipemodel.RELEVANCE
+
+# MySQL errors meaning that there is no FULLTEXT index for /search (1191: no matching index,
+# 1214: the storage engine does not support FULLTEXT). fulltext_missing is set once they occur.
+NO_FULLTEXT_ERRORS = (1191, 1214)
+fulltext_missing = False
+
+# Maximum number of suggestions returned by /suggest_terms
+MAX_SUGGESTIONS = 50
+
 
 @bp.route("/recipe_data")
+@utils.catalogue_etag
 def recipe_data():
     """Return all available recipe data."""
     complete = True if request.args.get("complete", "false").lower() == "true" else False
-    return get_recipe_data(published=True, complete_data=complete)
+    ndjson = request.args.get("format", "json").lower() == "ndjson"
+    stream = ndjson or request.args.get("stream", "false").lower() == "true"
+    return get_recipe_data(published=True, complete_data=complete, stream=stream, ndjson=ndjson)
 
 
 @bp.route("/recipe_suggestions")
@@ -29,29 +83,154 @@ def recipe_suggestions():
     return get_recipe_data(published=False)
 
 
-def get_recipe_data(published=False, complete_data=False):
-    """Return published or unpublished recipe data."""
+def get_listing_args(orders=recipemodel.ORDERS, default_order="newest"):
+    """Get sort order, cursor, limit and fields for recipe listings from the request arguments."""
+    order = request.args.get("order", default_order)
+    if order not in orders:
+        raise ValueError(f"Invalid order: {order}")
+    limit = request.args.get("limit")
+    limit = int(limit) if limit else None
+    if limit is not None and limit < 1:
+        raise ValueError(f"Invalid limit: {limit}")
+    cursor = recipemodel.decode_cursor(request.args.get("cursor"), order)
+    fields = recipemodel.parse_fields(request.args.get("fields"))
+    return {"order": order, "cursor": cursor, "limit": limit, "fields": fields}
+
+
+def load_listing(query, listing_args, complete_data=False):
+    """Get one page of recipes from query. Return data for the response."""
+    query = recipemodel.paginate(query.dicts(), listing_args["order"], listing_args["cursor"], listing_args["limit"])
+    recipes, next_cursor = recipemodel.split_page(query, listing_args["order"], listing_args["limit"])
+    data = recipemodel.get_recipes(recipes, complete_data=complete_data, fields=listing_args["fields"])
+    response = {"data": data, "hits": len(data)}
+    if listing_args["limit"]:
+        response["next_cursor"] = next_cursor
+    return response
+
+
+def load_ids(ids, listing_args):
+    """Get one page of recipes from a list of IDs that is ordered by listing_args["order"].
+
+    Return data for the response. The recipe data is taken from the recipe cache.
+    """
+    order = listing_args["order"]
+    limit = listing_args["limit"]
+    start = page_start(ids, listing_args["cursor"], order)
+    page_ids = ids[start:start + limit] if limit else ids[start:]
+    rows = get_recipe_rows(page_ids)
+    data = recipemodel.get_recipes(rows, fields=listing_args["fields"])
+    response = {"data": data, "hits": len(data)}
+    if limit:
+        response["next_cursor"] = None
+        if start + limit < len(ids):
+            if order == RELEVANCE:
+                # The cursor of a ranked listing is the offset of the next page
+                response["next_cursor"] = recipemodel.encode_cursor([start + limit])
+            else:
+                response["next_cursor"] = recipemodel.make_cursor(rows[-1], order)
+    return response
+
+
+def page_start(ids, cursor, order):
+    """Get the position in ids of the page after cursor."""
+    if not cursor:
+        return 0
+    if order == RELEVANCE:
+        return cursor[0]
+    if cursor[-1] in ids:
+        return ids.index(cursor[-1]) + 1
+    # The recipe the cursor points at is gone: count the recipes before it
+    if order == "title":
+        title, recipe_id = cursor
+        return recipemodel.Recipe.select().where(
+            recipemodel.Recipe.id.in_(ids)
+            & ((recipemodel.Recipe.title < title) | ((recipemodel.Recipe.title == title) & (recipemodel.Recipe.id < recipe_id)))
+        ).count()
+    return sum(1 for recipe_id in ids if recipe_id > cursor[0])
+
+
+def get_recipe_rows(ids):
+    """Get rows with all recipe columns and 'stored' for ids (in the same order) from the recipe cache."""
+    version = catalogue.sync()
+    rows = {recipe_id: recipe_cache.get(recipe_id) for recipe_id in ids}
+    missing = [recipe_id for recipe_id, row in rows.items() if row is None]
+    if missing:
+        query = recipemodel.Recipe.select(
+            *recipemodel.select_columns(recipemodel.ALL_FIELDS), storedmodel.Stored.stored.alias("stored")
+        ).join(
+            storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
+        ).where(
+            recipemodel.Recipe.id.in_(missing)
+        ).dicts()
+        for row in query:
+            recipe_cache.set(row["id"], row, version)
+            rows[row["id"]] = row
+    return [rows[recipe_id] for recipe_id in ids if rows[recipe_id] is not None]
+
+
+def stream_listing(query, listing_args, complete_data=False, ndjson=False):
+    """Stream one page of recipes from query without holding all of them in memory.
+
+    The MySQL driver buffers the complete result of a query, so the rows are read with one
+    keyset query per STREAM_PAGE_SIZE rows.
+    """
+    order = listing_args["order"]
+    limit = listing_args["limit"]
+    page = {}
+
+    def page_rows():
+        cursor = listing_args["cursor"]
+        remaining = limit
+        while True:
+            size = min(STREAM_PAGE_SIZE, remaining) if remaining else STREAM_PAGE_SIZE
+            rows, next_cursor = recipemodel.split_page(
+                recipemodel.paginate(query.dicts(), order, cursor, size), order, size)
+            yield from rows
+            if remaining:
+                remaining -= len(rows)
+            if next_cursor is None:
+                break
+            if remaining == 0:
+                page["next_cursor"] = next_cursor
+                break
+            cursor = recipemodel.decode_cursor(next_cursor, order)
+
+    def trailer():
+        return {"next_cursor": page.get("next_cursor")} if limit else {}
+
+    rows = recipemodel.iter_recipes(page_rows(), complete_data=complete_data, fields=listing_args["fields"])
+    return utils.stream_response("Data loaded", rows, trailer, ndjson=ndjson)
+
+
+def get_recipe_data(published=False, complete_data=False, stream=False, ndjson=False):
+    """Return published or unpublished recipe data. Stream the response if stream=True."""
     try:
+        listing_args = get_listing_args()
+    except ValueError as e:
+        return utils.error_response(f"{e}"), 400
+
+    try:
+        version = catalogue.sync()
+        cache_key = (published, complete_data, request.query_string)
+        payload = listing_cache.get(cache_key)
+        if payload is not None and not ndjson:
+            return utils.payload_response(payload)
+
+        columns = recipemodel.select_columns(listing_args["fields"], complete_data)
         Changed = User.alias()
         recipes = recipemodel.Recipe.select(
-            recipemodel.Recipe, storedmodel.Stored,
-            pw.fn.group_concat(tagmodel.Tag.tagname).alias("taglist")
+            *columns, storedmodel.Stored.stored.alias("stored")
         ).where(
             recipemodel.Recipe.published == published
         ).join(
             storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.RecipeTags, pw.JOIN.LEFT_OUTER, on=(tagmodel.RecipeTags.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.Tag, pw.JOIN.LEFT_OUTER, on=(tagmodel.Tag.id == tagmodel.RecipeTags.tagID)
-        ).group_by(
-            recipemodel.Recipe.id)
+        )
 
         if complete_data:
             # Load in User table
             recipes = recipes.select(
-                User, Changed, recipemodel.Recipe, storedmodel.Stored,
-                pw.fn.group_concat(tagmodel.Tag.tagname).alias("taglist")
+                *columns, storedmodel.Stored.stored.alias("stored"),
+                *recipemodel.user_columns(User, "created_by"), *recipemodel.user_columns(Changed, "changed_by")
             ).switch(
                 recipemodel.Recipe
             ).join(
@@ -61,11 +240,15 @@ def get_recipe_data(published=False, complete_data=False):
             ).join(
                 Changed, pw.JOIN.LEFT_OUTER, on=(Changed.id == recipemodel.Recipe.changed_by).alias("b"))
 
-        data = recipemodel.get_recipes(recipes, complete_data=complete_data)
-        return utils.success_response(msg="Data loaded", data=data, hits=len(data))
+        if stream:
+            return stream_listing(recipes, listing_args, complete_data, ndjson=ndjson)
+
+        payload = utils.success_payload(msg="Data loaded", **load_listing(recipes, listing_args, complete_data))
+        listing_cache.set(cache_key, payload, version)
+        return utils.payload_response(payload)
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
-        return utils.error_response(f"Failed to load data: {e}")
+        return utils.error_response(f"Failed to load data: {e}"), 500
 
 
 @bp.route("/preview_data", methods=['POST'])
@@ -87,12 +270,14 @@ def preview_data():
 
 
 @bp.route("/view_recipe")
+@utils.catalogue_etag
 def view_recipe():
     """Generate view for one recipe. Convert markdown data to html."""
     return get_recipe_from_db(convert=True)
 
 
 @bp.route("/get_recipe")
+@utils.catalogue_etag
 def get_recipe():
     """Get data for one recipe."""
     return get_recipe_from_db()
@@ -103,82 +288,152 @@ def get_recipe_from_db(convert=False):
     recipe_id = request.args.get("id")
     title = request.args.get("title")
     try:
-        Changed = User.alias()
-        recipes = recipemodel.Recipe.select(
-            recipemodel.Recipe, User, Changed, storedmodel.Stored,
-            pw.fn.group_concat(tagmodel.Tag.tagname).alias("taglist")
-        ).where(
+        recipe = load_recipe(
             recipemodel.Recipe.id == recipe_id if recipe_id else
-            recipemodel.Recipe.title == title
-        ).join(
-            storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
-        ).switch(
-            recipemodel.Recipe
-        ).join(
-            User, pw.JOIN.LEFT_OUTER, on=(User.id == recipemodel.Recipe.created_by).alias("a")
-        ).switch(
-            recipemodel.Recipe
-        ).join(
-            Changed, pw.JOIN.LEFT_OUTER, on=(Changed.id == recipemodel.Recipe.changed_by).alias("b")
-        ).switch(
-            recipemodel.Recipe
-        ).join(
-            tagmodel.RecipeTags, pw.JOIN.LEFT_OUTER, on=(tagmodel.RecipeTags.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.Tag, pw.JOIN.LEFT_OUTER, on=(tagmodel.Tag.id == tagmodel.RecipeTags.tagID)
-        ).group_by(recipemodel.Recipe.id)
-        recipe = recipemodel.get_recipe(recipes[0])
-
-        if convert:
-            recipe = utils.recipe2html(recipe)
-        if not recipe:
-            return utils.error_response(f"Could not find recipe '{title}'."), 404
+            recipemodel.Recipe.title == title,
+            convert
+        )
+        if recipe is None:
+            return utils.error_response(f"Could not find recipe with ID '{recipe_id}'"), 404
 
         return utils.success_response(msg="Data loaded", data=recipe)
 
-    except IndexError:
-        return utils.error_response(f"Could not find recipe with ID '{recipe_id}'"), 404
+    except Exception as e:
+        current_app.logger.error(traceback.format_exc())
+        return utils.error_response(f"Failed to load recipe: {e}"), 400
+
+
+@bp.route("/recipe/<slug>")
+@utils.catalogue_etag
+def get_recipe_by_url(slug):
+    """Get data for one recipe by its URL. Convert to html if html=true."""
+    convert = request.args.get("html", "false").lower() == "true"
+    cache = recipe_html_cache if convert else recipe_json_cache
+    try:
+        version = catalogue.sync()
+        # Resolve the URL (cached until the recipe changes)
+        recipe_id = url_cache.get(slug)
+        if recipe_id is None:
+            row = recipemodel.Recipe.select(recipemodel.Recipe.id).where(recipemodel.Recipe.url == slug).tuples().first()
+            if row is None:
+                return utils.error_response(f"Could not find recipe '{slug}'"), 404
+            recipe_id = row[0]
+            url_cache.set(slug, recipe_id)
+
+        url, payload = cache.get(recipe_id, (None, None))
+        if payload is None:
+            recipe = load_recipe(recipemodel.Recipe.id == recipe_id, convert)
+            url = recipe["url"] if recipe else None
+            payload = utils.success_payload(msg="Data loaded", data=recipe)
+            cache.set(recipe_id, (url, payload), version)
+        if url != slug:
+            # The recipe has been removed or got a new URL
+            url_cache.pop(slug)
+            return utils.error_response(f"Could not find recipe '{slug}'"), 404
+        return utils.payload_response(payload)
 
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Failed to load recipe: {e}"), 400
 
 
+@bp.route("/get_recipes", methods=["GET", "POST"])
+def get_recipes():
+    """Get data for several recipes by ID (ids=1,2,3 or a JSON body {"ids": [1, 2, 3]}).
+
+    Recipes are returned in the requested order, IDs that were not found are listed in 'missing'.
+    """
+    try:
+        if request.method == "POST" and request.is_json:
+            body = request.get_json(silent=True)
+            ids = body.get("ids") if isinstance(body, dict) else None
+            if not isinstance(ids, list) or any(isinstance(i, (bool, float)) for i in ids):
+                raise TypeError
+        elif request.method == "POST":
+            ids = request.form.get("ids", "").split(",")
+        else:
+            ids = request.args.get("ids", "").split(",")
+        ids = list(dict.fromkeys(int(i) for i in ids if str(i).strip()))
+    except (TypeError, ValueError):
+        return utils.error_response("Invalid ids (list of recipe IDs)"), 400
+    if not 1 <= len(ids) <= MAX_BATCH:
+        return utils.error_response(f"Invalid ids (1-{MAX_BATCH} recipe IDs)"), 400
+
+    try:
+        rows = {row["id"]: row for row in complete_recipe_query(recipemodel.Recipe.id.in_(ids))}
+        recipes = [row_to_recipe(rows[i]) for i in ids if i in rows]
+        missing = [i for i in ids if i not in rows]
+        return utils.success_response(msg="Data loaded", data=recipes, hits=len(recipes), missing=missing)
+    except Exception as e:
+        current_app.logger.error(traceback.format_exc())
+        return utils.error_response(f"Failed to load recipes: {e}"), 400
+
+
+def load_recipe(expr, convert=False):
+    """Get complete data for the recipe matching expr (None if there is none). Convert to html if convert=True."""
+    row = complete_recipe_query(expr, convert).first()
+    if row is None:
+        return None
+    return row_to_recipe(row, convert)
+
+
+def complete_recipe_query(expr, convert=False):
+    """Build query for complete data of the recipes matching expr (with the HTML columns if convert=True)."""
+    Changed = User.alias()
+    html_columns = [getattr(recipemodel.Recipe, c) for c in recipemodel.HTML_FIELDS.values()] if convert else []
+    return recipemodel.Recipe.select(
+        *recipemodel.select_columns(complete_data=True), storedmodel.Stored.stored.alias("stored"),
+        *recipemodel.user_columns(User, "created_by"), *recipemodel.user_columns(Changed, "changed_by"),
+        *html_columns
+    ).where(
+        expr
+    ).join(
+        storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
+    ).switch(
+        recipemodel.Recipe
+    ).join(
+        User, pw.JOIN.LEFT_OUTER, on=(User.id == recipemodel.Recipe.created_by).alias("a")
+    ).switch(
+        recipemodel.Recipe
+    ).join(
+        Changed, pw.JOIN.LEFT_OUTER, on=(Changed.id == recipemodel.Recipe.changed_by).alias("b")
+    ).dicts()
+
+
+def row_to_recipe(row, convert=False):
+    """Get complete recipe data from a row of complete_recipe_query. Convert to html if convert=True."""
+    recipe = recipemodel.get_recipe(row)
+    if convert:
+        for field, html_field in recipemodel.HTML_FIELDS.items():
+            # Use the HTML rendered at write time (unless the recipe has not been rendered yet)
+            if row[html_field] or not row[field]:
+                recipe[field] = row[html_field]
+            else:
+                recipe[field] = utils.md2html(row[field])
+    return recipe
+
+
 @bp.route("/add_recipe", methods=['POST'])
 @utils.gatekeeper()
 def add_recpie():
     """Add new recipe to the data base."""
-    recipe_id = None
-    filename = None
+    staged = None
     try:
         data = request.form.to_dict()
         data = utils.deserialize(data)
+        data = utils.render_html(data)
         data["user"] = session.get("uid")
         data["published"] = False if data.get("published", True).lower() == "false" else True
-        image_file = request.files.get("image")
-        recipe_id = recipemodel.add_recipe(data)
-        url = utils.make_url(data["title"], recipe_id)
-        recipemodel.set_url(recipe_id, url)
-        tagmodel.add_tags(data, recipe_id)
-        storedmodel.add_recipe(recipe_id)
-        save_image(data, recipe_id, image_file)
+        staged = stage_image(data, request.files.get("image"))
+        url = create_recipe(data, staged)
         return utils.success_response(msg="Recipe saved", url=url)
 
     except pw.IntegrityError:
+        remove_image(staged)
         return utils.error_response("Recipe title already exists!"), 409
 
     except Exception as e:
-        # Delete recipe data and image
-        if recipe_id is not None:
-            storedmodel.delete_recipe(recipe_id)
-            recipemodel.delete_recipe(recipe_id)
-        if filename is not None:
-            img_path = os.path.join(current_app.instance_path, current_app.config.get("IMAGE_PATH"))
-            filepath = os.path.join(img_path, filename)
-            try:
-                utils.remove_file(filepath)
-            except Exception:
-                current_app.logger.warning(f"Could not delete file: {filepath}")
+        remove_image(staged)
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Failed to save data: {e}"), 400
 
@@ -187,28 +442,31 @@ def add_recpie():
 @utils.gatekeeper()
 def edit_recpie():
     """Edit a recipe that already exists in the data base."""
+    staged = None
     try:
         data = request.form.to_dict()
         data = utils.deserialize(data)
+        data = utils.render_html(data)
         data["user"] = session.get("uid")  # Store info about which user edited last
         data["published"] = False if data.get("published", True).lower() == "false" else True
         url = utils.make_url(data["title"], data["id"])
         data["url"] = url
-        image_file = request.files.get("image")
-        if not image_file and not data["image"]:
-            recipe = recipemodel.Recipe.get(recipemodel.Recipe.id == data["id"])
-            if recipe.image:
-                try:
-                    utils.remove_file(utils.remove_file(os.path.join(current_app.config.get("IMAGE_PATH"), recipe.image)))
-                except OSError:
-                    current_app.logger.warning(traceback.format_exc())
-        else:
-            save_image(data, data["id"], image_file)
-        recipemodel.edit_recipe(data["id"], data)
-        tagmodel.add_tags(data, data["id"])
+        staged = stage_image(data, request.files.get("image"))
+        if staged:
+            data["image"] = utils.make_db_filename(staged, id=str(data["id"]), file_extension=".jpg")
+        with DATABASE.atomic():
+            old_image = recipemodel.get_image(data["id"])
+            recipemodel.edit_recipe(data["id"], data)
+            tags_changed = tagmodel.add_tags(data, data["id"])
+        log_saved(data["id"], tags_changed)
+        if staged:
+            data["image"] = publish_image(data["id"], staged, data["image"])
+        if old_image != data.get("image"):
+            remove_image(old_image)
         return utils.success_response(msg="Recipe saved", url=url)
 
     except Exception as e:
+        remove_image(staged)
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Failed to save data: {e}"), 400
 
@@ -217,20 +475,15 @@ def edit_recpie():
 @utils.gatekeeper(allow_guest=True)
 def suggest_recipe():
     """Save a recipe suggestion in the data base (published=False)."""
-    recipe_id = None
-    filename = None
+    staged = None
     try:
         data = request.form.to_dict()
         data = utils.deserialize(data)
+        data = utils.render_html(data)
         data["user"] = session.get("uid")
         data["published"] = False
-        image_file = request.files.get("image")
-        recipe_id = recipemodel.add_recipe(data)
-        url = utils.make_url(data["title"], recipe_id)
-        recipemodel.set_url(recipe_id, url)
-        tagmodel.add_tags(data, recipe_id)
-        storedmodel.add_recipe(recipe_id)
-        save_image(data, recipe_id, image_file)
+        staged = stage_image(data, request.files.get("image"))
+        url = create_recipe(data, staged)
 
         # Attempt to send email to admins
         try:
@@ -245,56 +498,124 @@ def suggest_recipe():
         return utils.success_response(msg="Recipe saved", url=url)
 
     except pw.IntegrityError:
+        remove_image(staged)
         return utils.error_response("Recipe title already exists!"), 409
 
     except Exception as e:
-        # Delete recipe data and image
-        if recipe_id is not None:
-            storedmodel.delete_recipe(recipe_id)
-            recipemodel.delete_recipe(recipe_id)
-        if filename is not None:
-            img_path = os.path.join(current_app.instance_path, current_app.config.get("IMAGE_PATH"))
-            filepath = os.path.join(img_path, filename)
-            try:
-                utils.remove_file(filepath)
-            except Exception:
-                current_app.logger.warning(f"Could not delete file: {filepath}")
+        remove_image(staged)
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Failed to save data: {e}"), 400
 
 
-def save_image(data, recipe_id, image_file):
-    """Save uploaded image in data base."""
-    img_path = os.path.join(current_app.instance_path, current_app.config.get("IMAGE_PATH"))
-    thumb_destfolder = os.path.join(current_app.instance_path, current_app.config.get("THUMBNAIL_PATH"))
-    medium_destfolder = os.path.join(current_app.instance_path, current_app.config.get("MEDIUM_IMAGE_PATH"))
+def create_recipe(data, staged=None):
+    """Save a new recipe with its tags in one transaction and publish its staged image once it is committed.
 
-    if image_file:
-        # Get filename and save image
-        filename = utils.make_db_filename(image_file, id=str(recipe_id), file_extension=".jpg")
-        utils.save_upload_image(image_file, filename, img_path)
-        # Edit row to add image path
-        data["image"] = filename
-        recipemodel.set_image(recipe_id, data)
-        # Save thumbnail
-        src = os.path.join(img_path, filename)
-        utils.save_downscaled(src, thumb_destfolder, thumbnail=True)
-        utils.save_downscaled(src, medium_destfolder)
+    Return the recipe URL.
+    """
+    with DATABASE.atomic():
+        recipe_id = recipemodel.add_recipe(data)
+        url = utils.make_url(data["title"], recipe_id)
+        image = None
+        if staged:
+            image = data["image"] = utils.make_db_filename(staged, id=str(recipe_id), file_extension=".jpg")
+        recipemodel.set_url(recipe_id, url, image)
+        tags_changed = tagmodel.add_tags(data, recipe_id)
+        storedmodel.add_recipe(recipe_id)
+    log_saved(recipe_id, tags_changed)
+    if staged:
+        publish_image(recipe_id, staged, image)
+    return url
+
+
+def image_folders():
+    """Get the folders for images, thumbnails and medium sized images."""
+    return [os.path.join(current_app.instance_path, current_app.config.get(path))
+            for path in ("IMAGE_PATH", "THUMBNAIL_PATH", "MEDIUM_IMAGE_PATH")]
+
+
+def stage_image(data, image_file):
+    """Save uploaded image and its downscaled versions under a temporary file name.
+
+    Return the temporary file name (or None if the recipe has no new image).
+    The files are renamed by publish_image once the recipe is committed.
+    """
+    img_path, thumb_destfolder, medium_destfolder = image_folders()
+    staged = "staged-" + utils.make_random_filename(image_file, file_extension=".jpg")
+    try:
+        if image_file:
+            utils.save_upload_image(image_file, staged, img_path)
+
+        # When recipe was parsed from external source, image is already uploaded
+        elif data.get("image") and data.get("image", "").startswith("tmp"):
+            # Get path to file and copy it from tmp to img folder
+            src_directory = os.path.join(current_app.instance_path, current_app.config.get("TMP_DIR"))
+            src = os.path.join(src_directory, os.path.split(data["image"])[1])
+            utils.copy_file(src, img_path, staged)
+
+        else:
+            return None
 
-    # When recipe was parsed from external source, image is already uploaded
-    elif data.get("image") and data.get("image", "").startswith("tmp"):
-        filename = utils.make_db_filename(data["image"], id=str(recipe_id), file_extension=".jpg")
-        # Get path to file and copy it from tmp to img folder
-        src_directory = os.path.join(current_app.instance_path, current_app.config.get("TMP_DIR"))
-        src = os.path.join(src_directory, os.path.split(data["image"])[1])
-        utils.copy_file(src, img_path, filename)
-        # Edit row to add image file name
-        data["image"] = filename
-        recipemodel.set_image(recipe_id, data)
         # Save thumbnail
-        src = os.path.join(img_path, filename)
+        src = os.path.join(img_path, staged)
         utils.save_downscaled(src, thumb_destfolder, thumbnail=True)
         utils.save_downscaled(src, medium_destfolder)
+    except Exception:
+        remove_image(staged)
+        raise
+    return staged
+
+
+def promote_image(staged, filename):
+    """Rename the staged image files to their final file name."""
+    for folder in image_folders():
+        os.replace(os.path.join(folder, staged), os.path.join(folder, filename))
+
+
+def publish_image(recipe_id, staged, filename):
+    """Promote the staged image of a committed recipe and return its file name.
+
+    If that fails the recipe stays saved without image: log the error, remove the image from
+    the recipe and return "".
+    """
+    try:
+        promote_image(staged, filename)
+        return filename
+    except Exception:
+        current_app.logger.error(f"Could not save image of recipe {recipe_id}: {traceback.format_exc()}")
+        remove_image(staged)
+        remove_image(filename)
+        try:
+            recipemodel.set_image(recipe_id, {"image": ""})
+        except Exception:
+            current_app.logger.error(f"Could not remove image from recipe {recipe_id}: {traceback.format_exc()}")
+        log_saved(recipe_id)
+        return ""
+
+
+def log_saved(recipe_id, tags_changed=False):
+    """Log the change of a committed recipe (and of the tags if tags_changed is set).
+
+    The recipe is saved already, so a failure is only logged: the other workers see the change
+    with the next logged change.
+    """
+    try:
+        catalogue.changed(recipe_id)
+        if tags_changed:
+            catalogue.changed(kind=changemodel.TAGS)
+    except Exception:
+        current_app.logger.error(f"Could not log change of recipe {recipe_id}: {traceback.format_exc()}")
+
+
+def remove_image(filename):
+    """Delete an image and its downscaled versions (if they exist)."""
+    if not filename:
+        return
+    for folder in image_folders():
+        filepath = os.path.join(folder, filename)
+        try:
+            utils.remove_file(filepath)
+        except Exception:
+            current_app.logger.warning(f"Could not delete file: {filepath}")
 
 
 @bp.route("/delete_recipe")
@@ -308,9 +629,12 @@ def delete_recpie():
             utils.remove_file(os.path.join(current_app.config.get("IMAGE_PATH"), recipe.image))
             utils.remove_file(os.path.join(current_app.config.get("THUMBNAIL_PATH"), recipe.image))
             utils.remove_file(os.path.join(current_app.config.get("MEDIUM_IMAGE_PATH"), recipe.image))
-        tagmodel.delete_recipe(recipe_id)
+        tags_changed = tagmodel.delete_recipe(recipe_id)
         storedmodel.delete_recipe(recipe_id)
         recipemodel.delete_recipe(recipe_id)
+        catalogue.changed(recipe_id)
+        if tags_changed:
+            catalogue.changed(kind=changemodel.TAGS)
         return utils.success_response(msg="Recipe removed")
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
@@ -320,146 +644,277 @@ def delete_recpie():
 @bp.route("/search")
 def search():
     """Search recipe data base."""
+    tag = request.args.get("tag")
+    user = request.args.get("user")
+    q = request.args.get("q")
+    use_index = q and not tag and not user and current_app.config.get("SEARCH_INDEX")
+    fuzzy = request.args.get("fuzzy", "false").lower() == "true"
+    facets = request.args.get("facets", "false").lower() == "true"
+
     try:
-        tag = request.args.get("tag")
-        user = request.args.get("user")
-        q = request.args.get("q")
+        if use_index:
+            listing_args = get_listing_args(orders=recipemodel.ORDERS + [RELEVANCE], default_order=RELEVANCE)
+        else:
+            listing_args = get_listing_args()
+    except ValueError as e:
+        return utils.error_response(f"{e}"), 400
 
+    try:
         if tag:
-            # Tag Search
             querytype = "tag"
-
-            tagset = set(tag.split(","))
-            tagstructure = tagmodel.get_tag_structure(simple=True)
-            taggroups = []
-            for cat in tagstructure:
-                selected_tags = list(set(cat.get("tags")).intersection(tagset))
-                if selected_tags:
-                    taggroups.append(selected_tags)
-
-            # Chain tags with OR within a category and with AND between categories
-            and_expressions = []
-            for taggroup in taggroups:
-                or_expressions = [
-                    pw.fn.FIND_IN_SET(tag, pw.fn.group_concat(tagmodel.Tag.tagname))
-                    for tag in taggroup
-                ]
-                and_expressions.append(reduce(pw.operator.or_, or_expressions))
-            expr = reduce(pw.operator.and_, and_expressions)
-
+            cache_key = (querytype, tuple(sorted(set(tag.split(",")))))
         elif user:
-            # User search
             querytype = "user"
-            expr = ((User.displayname == user) | recipemodel.Recipe.suggester.contains(user))
-
+            cache_key = (querytype, user)
+        elif use_index:
+            querytype = "q"
+            cache_key = (querytype, tuple(tuple(terms) for terms in parse_query(q)), fuzzy)
         else:
-            # String search: seperate by whitespace and search in all relevant fields
             querytype = "q"
-            if len(q) > 1 and q.startswith('"') and q.endswith('"'):
-                searchitems = [q[1:-1]]
-            else:
-                searchitems = q.split(" ")
-                searchitems = [i.rstrip(",") for i in searchitems]
-
-            expr_list = [
-                (
-                    recipemodel.Recipe.title.contains(s)
-                    | recipemodel.Recipe.contents.contains(s)
-                    | recipemodel.Recipe.ingredients.contains(s)
-                    | recipemodel.Recipe.source.contains(s)
-                    | User.username.contains(s)
-                    | pw.fn.FIND_IN_SET(s, pw.fn.group_concat(tagmodel.Tag.tagname))
-                ) for s in searchitems
-            ]
-            expr = reduce(pw.operator.and_, expr_list)
-
-        # Build query
-        Changed = User.alias()
-        query = recipemodel.Recipe.select(
-            recipemodel.Recipe, User, Changed, storedmodel.Stored,
-            pw.fn.group_concat(tagmodel.Tag.tagname).alias("taglist")
-        ).join(
-            storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
-        ).join(
-            User, pw.JOIN.LEFT_OUTER, on=(User.id == recipemodel.Recipe.created_by).alias("a")
-        ).switch(
-            recipemodel.Recipe
-        ).join(
-            Changed, pw.JOIN.LEFT_OUTER, on=(Changed.id == recipemodel.Recipe.changed_by).alias("b")
-        ).switch(
-            recipemodel.Recipe
-        ).join(
-            tagmodel.RecipeTags, pw.JOIN.LEFT_OUTER, on=(tagmodel.RecipeTags.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.Tag, pw.JOIN.LEFT_OUTER, on=(tagmodel.Tag.id == tagmodel.RecipeTags.tagID)
-        ).group_by(
-            recipemodel.Recipe.id
-        ).where(
-            (recipemodel.Recipe.published == True)
-        ).having(expr)
-
-        data = recipemodel.get_recipes(query)
-        message = f"Query: {querytype}={q}"
-        return utils.success_response(msg=message, data=data, hits=len(data))
+            cache_key = ("sql", q.strip().lower())
+        cache_key += (listing_args["order"],)
+
+        # Get IDs of all matching recipes from the search cache or run the search
+        version = catalogue.sync()
+        ids = search_cache.get(cache_key)
+        if ids is None:
+            ids = find_recipes(tag, user, q, listing_args["order"], use_index, fuzzy)
+            search_cache.set(cache_key, ids, version)
+
+        results = load_ids(ids, listing_args)
+        if facets:
+            results["facets"] = get_facets(ids)
+        if use_index and request.args.get("highlight", "false").lower() == "true":
+            snippets = search_index.snippets(q, [r["id"] for r in results["data"]], fuzzy)
+            for recipe in results["data"]:
+                recipe["highlight"] = snippets.get(recipe["id"])
+        return utils.success_response(msg=f"Query: {querytype}={q}", **results)
 
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Query failed: {e}"), 400
 
 
+def find_recipes(tag, user, q, order, use_index=False, fuzzy=False):
+    """Get the IDs of all published recipes matching a tag, user or string search in the given order."""
+    global fulltext_missing
+    if tag:
+        # Tag Search
+        tagmap = get_tag_map()
+        taggroups = defaultdict(set)
+        for tagname in set(tag.split(",")):
+            tag_id, category_id = tagmap.get(tagname, (None, None))
+            if category_id is not None:
+                taggroups[category_id].add(tag_id)
+
+        # Chain tags with OR within a category and with AND between categories
+        and_expressions = [tagmodel.has_any_tag(tag_ids) for tag_ids in taggroups.values()]
+        expr = reduce(pw.operator.and_, and_expressions) if and_expressions else tagmodel.has_any_tag([])
+        return search_ids(expr, order)
+
+    if user:
+        # User search
+        return search_ids((User.displayname == user) | recipemodel.Recipe.suggester.contains(user), order)
+
+    if use_index:
+        # String search in the in-process search index
+        if order == RELEVANCE:
+            return search_index.rank(q, fuzzy)
+        return search_ids(recipemodel.Recipe.id.in_(list(search_index.search(q, fuzzy))), order)
+
+    # String search: seperate by whitespace and search in all relevant fields
+    if len(q) > 1 and q.startswith('"') and q.endswith('"'):
+        searchitems = [q[1:-1]]
+    else:
+        searchitems = q.split(" ")
+        searchitems = [i.rstrip(",") for i in searchitems]
+
+    fulltext = current_app.config.get("SEARCH_FULLTEXT") and not fulltext_missing
+    try:
+        return search_ids(string_search_expression(searchitems, fulltext), order)
+    except (pw.InternalError, pw.OperationalError, pw.ProgrammingError) as e:
+        if not fulltext or not e.args or e.args[0] not in NO_FULLTEXT_ERRORS:
+            raise
+        current_app.logger.warning(f"FULLTEXT index is missing, falling back to LIKE: {e}")
+        fulltext_missing = True
+        return search_ids(string_search_expression(searchitems, fulltext=False), order)
+
+
+@bp.route("/suggest_terms")
+@utils.catalogue_etag
+def suggest_terms():
+    """Return tags, recipe titles and ingredients starting with prefix (for typeahead)."""
+    prefix = request.args.get("prefix", "")
+    try:
+        limit = int(request.args.get("limit", 10))
+        if not 1 <= limit <= MAX_SUGGESTIONS:
+            raise ValueError
+    except ValueError:
+        return utils.error_response(f"Invalid limit (1-{MAX_SUGGESTIONS})"), 400
+
+    try:
+        data = [{"type": kind, "text": text} for kind, text in suggestion_index.suggest(prefix, limit)]
+        return utils.success_response(msg=f"Suggestions for: {prefix}", data=data, hits=len(data))
+    except Exception as e:
+        current_app.logger.error(traceback.format_exc())
+        return utils.error_response(f"Failed to load suggestions: {e}"), 400
+
+
+@bp.route("/cache_stats")
+@utils.gatekeeper()
+def cache_stats():
+    """Return size and hit rate of the in-process caches (for monitoring)."""
+    data = {
+        "listing": listing_cache.stats(),
+        "search": search_cache.stats(),
+        "recipe": recipe_cache.stats(),
+        "recipe_json": recipe_json_cache.stats(),
+        "recipe_html": recipe_html_cache.stats(),
+        "url": url_cache.stats(),
+        "tag": tag_cache.stats(),
+        "random": random_cache.stats()
+    }
+    return utils.success_response(msg="Cache statistics", data=data)
+
+
+def get_facets(recipe_ids):
+    """Get {tagname: number of recipes} for the recipes in recipe_ids (one grouped query)."""
+    tagnames = {tag_id: tagname for tagname, (tag_id, _category_id) in get_tag_map().items()}
+    counts = tagmodel.get_tag_counts(list(recipe_ids))
+    return {tagnames[tag_id]: n for tag_id, n in counts.items() if tag_id in tagnames}
+
+
+def clear_tag_cache(changes, version=None):
+    """Drop the tag cache if tags have been created or removed. Subscriber for the catalogue."""
+    if changes is None or any(kind == changemodel.TAGS for _recipe_id, kind in changes):
+        tag_cache.clear(version=version)
+
+
+catalogue.subscribe(clear_tag_cache)
+
+
+def get_tag_map():
+    """Get {tagname: (tag ID, category ID)} from the tag cache."""
+    version = catalogue.sync()
+    tagmap = tag_cache.get("tagmap")
+    if tagmap is None:
+        tagmap = tagmodel.get_tag_map()
+        tag_cache.set("tagmap", tagmap, version)
+    return tagmap
+
+
+def get_tag_rows():
+    """Get all categories and tags (see tagmodel.get_tag_rows) from the tag cache."""
+    version = catalogue.sync()
+    rows = tag_cache.get("tagrows")
+    if rows is None:
+        rows = tagmodel.get_tag_rows()
+        tag_cache.set("tagrows", rows, version)
+    return rows
+
+
+def string_search_expression(searchitems, fulltext=False):
+    """Create expression matching recipes containing all searchitems in a text field, username or tags."""
+    expr_list = [
+        (
+            recipemodel.text_search(s, fulltext)
+            | User.username.contains(s)
+            | recipemodel.has_tag(s)
+        ) for s in searchitems
+    ]
+    return reduce(pw.operator.and_, expr_list)
+
+
+def search_ids(expr, order="newest"):
+    """Get the IDs of all published recipes matching expr in the given order."""
+    query = recipemodel.Recipe.select(recipemodel.Recipe.id).join(
+        User, pw.JOIN.LEFT_OUTER, on=(User.id == recipemodel.Recipe.created_by)
+    ).where(
+        (recipemodel.Recipe.published == True) & expr
+    )
+    return [row[0] for row in recipemodel.paginate(query, order).tuples()]
+
+
 @bp.route("/get_tag_categories")
+@utils.catalogue_etag
 def get_tag_categories():
     """Return a list of tag categories."""
-    cats = tagmodel.get_tag_categories()
+    cats = tagmodel.get_tag_categories(rows=get_tag_rows())
     return utils.success_response(msg="", data=cats)
 
 
 @bp.route("/get_tag_structure")
+@utils.catalogue_etag
 def get_tag_structure():
-    cats = tagmodel.get_tag_structure()
+    counts = request.args.get("counts", "false").lower() == "true"
+    cats = tagmodel.get_tag_structure(counts=counts, rows=get_tag_rows())
     return utils.success_response(msg="", data=cats)
 
 
 @bp.route("/get_tag_structure_simple")
+@utils.catalogue_etag
 def get_tag_structure_simple():
-    cats = tagmodel.get_tag_structure(simple=True)
+    cats = tagmodel.get_tag_structure(simple=True, rows=get_tag_rows())
     return utils.success_response(msg="", data=cats)
 
 
 @bp.route("/random")
 def get_random_recipe():
-    """Return one recipe at random from randomizer categories in config."""
-    tags = current_app.config.get("RANDOM_TAGS", [])
-
-    or_expressions = reduce(pw.operator.or_, [
-        pw.fn.FIND_IN_SET(tag, pw.fn.group_concat(tagmodel.Tag.tagname))
-        for tag in tags
-    ])
+    """Return n (default 1) different recipes at random from randomizer categories in config.
 
+    Recipe IDs listed in exclude (comma separated) are not returned.
+    """
+    tags = current_app.config.get("RANDOM_TAGS", [])
     try:
-        recipes = recipemodel.Recipe.select(
-            recipemodel.Recipe, storedmodel.Stored, pw.fn.group_concat(tagmodel.Tag.tagname).alias("taglist")
-        ).where(
-            recipemodel.Recipe.published == True
-        ).join(
-            storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.RecipeTags, pw.JOIN.LEFT_OUTER, on=(tagmodel.RecipeTags.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.Tag, pw.JOIN.LEFT_OUTER, on=(tagmodel.Tag.id == tagmodel.RecipeTags.tagID)
-        ).group_by(
-            recipemodel.Recipe.id
-        ).having(
-            or_expressions
-        )
+        n = int(request.args.get("n", 1))
+        if not 1 <= n <= MAX_RANDOM:
+            raise ValueError
+        exclude = set(int(i) for i in request.args.get("exclude", "").split(",") if i.strip())
+    except ValueError:
+        return utils.error_response(f"Invalid n (1-{MAX_RANDOM}) or exclude (list of IDs)"), 400
 
-        recipe = [random.choice(recipemodel.get_recipes(recipes))]
-        return utils.success_response(msg="Got random recipe", data=recipe, hits=len(recipe))
+    try:
+        pool = get_random_pool(tags)
+        recipe_ids = sample_ids(pool, n, exclude)
+        if not recipe_ids:
+            return utils.error_response("No recipes to choose from")
+        recipes = recipemodel.get_recipes(get_recipe_rows(recipe_ids))
+        return utils.success_response(msg="Got random recipe", data=recipes, hits=len(recipes))
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Failed to load data: {e}")
 
 
+def get_random_pool(tags):
+    """Get the IDs of the published recipes with any of tags from the random cache."""
+    version = catalogue.sync()
+    key = tuple(sorted(tags))
+    pool = random_cache.get(key)
+    if pool is None:
+        tagmap = get_tag_map()
+        tag_ids = [tagmap[tag][0] for tag in tags if tag in tagmap]
+        pool = search_ids(tagmodel.has_any_tag(tag_ids))
+        random_cache.set(key, pool, version)
+    return pool
+
+
+def sample_ids(pool, n, exclude=()):
+    """Pick up to n different IDs from pool at random, skipping the IDs in exclude."""
+    if len(exclude) + n > len(pool) // 2:
+        # Most of the pool is taken: choose among the remaining IDs
+        candidates = [recipe_id for recipe_id in pool if recipe_id not in exclude]
+        return random.sample(candidates, min(n, len(candidates)))
+    # Draw until there are n new IDs (few retries since most of the pool is free)
+    picked = []
+    taken = set(exclude)
+    while len(picked) < n:
+        recipe_id = random.choice(pool)
+        if recipe_id not in taken:
+            taken.add(recipe_id)
+            picked.append(recipe_id)
+    return picked
+
+
 @bp.route("/toggle_stored", methods=["POST"])
 @utils.gatekeeper()
 def toggle_stored():
@@ -468,6 +923,7 @@ def toggle_stored():
         data = request.get_json()
         stored = data.get("stored", False)
         storedmodel.toggle_stored(data["id"], stored)
+        catalogue.changed(data["id"])
         if stored:
             return utils.success_response(msg="Recipe stored")
         else:
@@ -482,21 +938,21 @@ def toggle_stored():
 @utils.gatekeeper()
 def stored_recipes():
     """Return data for all stored recipes."""
+    try:
+        listing_args = get_listing_args()
+    except ValueError as e:
+        return utils.error_response(f"{e}"), 400
+
     try:
         recipes = recipemodel.Recipe.select(
-            recipemodel.Recipe, storedmodel.Stored, pw.fn.group_concat(tagmodel.Tag.tagname).alias("taglist")
+            *recipemodel.select_columns(listing_args["fields"]), storedmodel.Stored.stored.alias("stored")
         ).join(
             storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
         ).where(
             storedmodel.Stored.stored == True
-        ).join(
-            tagmodel.RecipeTags, pw.JOIN.LEFT_OUTER, on=(tagmodel.RecipeTags.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.Tag, pw.JOIN.LEFT_OUTER, on=(tagmodel.Tag.id == tagmodel.RecipeTags.tagID)
-        ).group_by(recipemodel.Recipe.id)
+        )
 
-        data = recipemodel.get_recipes(recipes)
-        return utils.success_response(msg="Data loaded", data=data, hits=len(data))
+        return utils.success_response(msg="Data loaded", **load_listing(recipes, listing_args))
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Failed to load data: {e}")
@@ -511,6 +967,7 @@ def toggle_needs_fix():
         data = utils.deserialize(data)
         needs_fix = data.get("needs_fix", False)
         recipemodel.toggle_needs_fix(data["id"], needs_fix)
+        catalogue.changed(data["id"])
         if needs_fix:
             return utils.success_response(msg="Recipe marked as 'needs_fix'")
         else:
@@ -525,21 +982,21 @@ def toggle_needs_fix():
 @utils.gatekeeper()
 def needs_fix_recipes():
     """Return data for all recipes that need fixes."""
+    try:
+        listing_args = get_listing_args()
+    except ValueError as e:
+        return utils.error_response(f"{e}"), 400
+
     try:
         recipes = recipemodel.Recipe.select(
-            recipemodel.Recipe, storedmodel.Stored, pw.fn.group_concat(tagmodel.Tag.tagname).alias("taglist")
+            *recipemodel.select_columns(listing_args["fields"]), storedmodel.Stored.stored.alias("stored")
         ).where(
             recipemodel.Recipe.needs_fix == True
         ).join(
             storedmodel.Stored, pw.JOIN.LEFT_OUTER, on=(storedmodel.Stored.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.RecipeTags, pw.JOIN.LEFT_OUTER, on=(tagmodel.RecipeTags.recipeID == recipemodel.Recipe.id)
-        ).join(
-            tagmodel.Tag, pw.JOIN.LEFT_OUTER, on=(tagmodel.Tag.id == tagmodel.RecipeTags.tagID)
-        ).group_by(recipemodel.Recipe.id)
+        )
 
-        data = recipemodel.get_recipes(recipes)
-        return utils.success_response(msg="Data loaded", data=data, hits=len(data))
+        return utils.success_response(msg="Data loaded", **load_listing(recipes, listing_args))
     except Exception as e:
         current_app.logger.error(traceback.format_exc())
         return utils.error_response(f"Failed to load data: {e}")